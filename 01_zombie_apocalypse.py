@@ -2,11 +2,22 @@
 Student portion of Zombie Apocalypse mini-project
 """
 
+import sys
+import time
 import random
+import heapq
+import collections
+from array import array
 import poc_grid
 import poc_queue
 import poc_zombie_gui
 
+# numpy is not available on CodeSkulptor, only the BFS engine works there
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 # global constants
 EMPTY = 0 
 FULL = 1
@@ -16,6 +27,302 @@ OBSTACLE = "obstacle"
 HUMAN = "human"
 ZOMBIE = "zombie"
 
+# distance field engines
+BFS_ENGINE = "bfs"
+NUMPY_ENGINE = "numpy"
+COMPACT_ENGINE = "compact"
+ENGINES = (BFS_ENGINE, NUMPY_ENGINE, COMPACT_ENGINE)
+
+# tiles of compact storage are TILE_SIZE x TILE_SIZE cells
+TILE_SHIFT = 6
+TILE_SIZE = 1 << TILE_SHIFT
+TILE_MASK = TILE_SIZE - 1
+TILE_AREA = TILE_SIZE * TILE_SIZE
+# unreachable marker in 16 bit distance tiles
+UNREACHED_16 = 0xFFFF
+# estimated bytes per cell of a list of lists distance field,
+# one list slot and one boxed int
+LIST_CELL_BYTES = 32
+
+# incremental repair gives up and recomputes the whole field when more
+# than REPAIR_MAX_CHANGES sources and obstacles changed or more than
+# 1 / REPAIR_RAISED_FRACTION of the cells lose, or are expected to
+# lose, their shortest path,
+# repairing a cell costs several times as much as a BFS visit
+REPAIR_MAX_CHANGES = 16
+REPAIR_RAISED_FRACTION = 32
+
+# neighbor offsets in the same order as poc_grid four_neighbors/eight_neighbors
+FOUR_OFFSETS = ((-1, 0), (1, 0), (0, -1), (0, 1))
+EIGHT_OFFSETS = FOUR_OFFSETS + ((-1, -1), (-1, 1), (1, -1), (1, 1))
+
+
+class TiledBitGrid:
+    """
+    Sparse grid of bits split in square tiles, a tile is only stored
+    while at least one of its bits is set
+    """
+
+    def __init__(self, grid_height, grid_width):
+        """
+        Create grid of given size with all bits cleared
+        """
+        self._grid_height = grid_height
+        self._grid_width = grid_width
+        self._tiles = {}
+
+    def clear(self):
+        """
+        Clear all bits
+        """
+        self._tiles = {}
+
+    def get(self, row, col):
+        """
+        Return True if bit at (row, col) is set
+        """
+        tile = self._tiles.get((row >> TILE_SHIFT, col >> TILE_SHIFT))
+        if tile is None:
+            return False
+        bit = ((row & TILE_MASK) << TILE_SHIFT) | (col & TILE_MASK)
+        return (tile[bit >> 3] >> (bit & 7)) & 1 == 1
+
+    def set(self, row, col):
+        """
+        Set bit at (row, col)
+        """
+        key = (row >> TILE_SHIFT, col >> TILE_SHIFT)
+        tile = self._tiles.get(key)
+        if tile is None:
+            tile = self._tiles[key] = bytearray(TILE_AREA >> 3)
+        bit = ((row & TILE_MASK) << TILE_SHIFT) | (col & TILE_MASK)
+        tile[bit >> 3] |= 1 << (bit & 7)
+
+    def reset(self, row, col):
+        """
+        Clear bit at (row, col), drops the tile once it is all clear
+        """
+        key = (row >> TILE_SHIFT, col >> TILE_SHIFT)
+        tile = self._tiles.get(key)
+        if tile is None:
+            return
+        bit = ((row & TILE_MASK) << TILE_SHIFT) | (col & TILE_MASK)
+        tile[bit >> 3] &= ~(1 << (bit & 7)) & 0xFF
+        if not any(tile):
+            del self._tiles[key]
+
+    def num_tiles(self):
+        """
+        Return number of stored tiles
+        """
+        return len(self._tiles)
+
+
+class TiledDistanceField:
+    """
+    Sparse distance field split in square tiles of typed arrays,
+    missing tiles are unreachable
+    Tiles start as 16 bit arrays and are widened to 32 bits when
+    a reachable distance does not fit, unreachable cells of 16 bit
+    tiles hold UNREACHED_16
+    Supports distance_field[row][col] like a list of lists
+    """
+
+    def __init__(self, grid_height, grid_width):
+        """
+        Create field of given size with all cells unreachable,
+        unreachable cells read as grid_height * grid_width
+        """
+        self._grid_height = grid_height
+        self._grid_width = grid_width
+        self._unreachable = grid_height * grid_width
+        self._tiles = {}
+
+    def get_grid_width(self):
+        """
+        Return number of columns
+        """
+        return self._grid_width
+
+    def get(self, row, col):
+        """
+        Return distance at (row, col)
+        """
+        tile = self._tiles.get((row >> TILE_SHIFT, col >> TILE_SHIFT))
+        if tile is None:
+            return self._unreachable
+        value = tile[((row & TILE_MASK) << TILE_SHIFT) | (col & TILE_MASK)]
+        if value == UNREACHED_16 and tile.typecode == "H":
+            return self._unreachable
+        return value
+
+    def set(self, row, col, value):
+        """
+        Set distance at (row, col)
+        """
+        key = (row >> TILE_SHIFT, col >> TILE_SHIFT)
+        tile = self._tiles.get(key)
+        if tile is None:
+            tile = self._tiles[key] = array("H", [UNREACHED_16]) * TILE_AREA
+        if tile.typecode == "H":
+            if value == self._unreachable:
+                value = UNREACHED_16
+            elif value >= UNREACHED_16:
+                tile = self._tiles[key] = array("i", [self._unreachable if old == UNREACHED_16
+                                                      else old for old in tile])
+        tile[((row & TILE_MASK) << TILE_SHIFT) | (col & TILE_MASK)] = value
+
+    def __getitem__(self, row):
+        """
+        Return row view, so that field[row][col] works
+        """
+        return _DistanceRow(self, row)
+
+    def __len__(self):
+        """
+        Return number of rows
+        """
+        return self._grid_height
+
+    def __iter__(self):
+        """
+        Iterate over row views
+        """
+        for row in range(self._grid_height):
+            yield _DistanceRow(self, row)
+
+    def memory_size(self):
+        """
+        Return number of bytes used by stored tiles
+        """
+        return sum(len(tile) * tile.itemsize for tile in self._tiles.values())
+
+    def tolist(self):
+        """
+        Return distances as a list of lists
+        """
+        return [[self.get(row, col) for col in range(self._grid_width)]
+                for row in range(self._grid_height)]
+
+    def num_tiles(self):
+        """
+        Return number of stored tiles
+        """
+        return len(self._tiles)
+
+
+class _DistanceRow:
+    """
+    Row view of a TiledDistanceField
+    """
+
+    def __init__(self, field, row):
+        """
+        Create view of row of field
+        """
+        self._field = field
+        self._row = row
+
+    def __getitem__(self, col):
+        """
+        Return distance at column col
+        """
+        return self._field.get(self._row, col)
+
+    def __setitem__(self, col, value):
+        """
+        Set distance at column col
+        """
+        self._field.set(self._row, col, value)
+
+    def __len__(self):
+        """
+        Return number of columns
+        """
+        return self._field.get_grid_width()
+
+    def __iter__(self):
+        """
+        Iterate over distances of the row
+        """
+        for col in range(len(self)):
+            yield self._field.get(self._row, col)
+
+
+def field_memory_size(distance_field):
+    """
+    Return estimated number of bytes used by a distance field
+    """
+    if isinstance(distance_field, TiledDistanceField):
+        return distance_field.memory_size()
+    if hasattr(distance_field, "nbytes"):
+        return distance_field.nbytes
+    return len(distance_field) * len(distance_field[0]) * LIST_CELL_BYTES
+
+
+class LRUFieldCache:
+    """
+    Least recently used cache of distance fields bounded by the
+    estimated memory of the cached fields
+    """
+
+    def __init__(self, max_bytes):
+        """
+        Create empty cache holding at most max_bytes of fields
+        """
+        self._max_bytes = max_bytes
+        self._fields = collections.OrderedDict()
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def clear(self):
+        """
+        Drop all cached fields, counters are kept
+        """
+        self._fields.clear()
+        self._bytes = 0
+
+    def get(self, key):
+        """
+        Return cached field for key or None, counts hits and misses
+        """
+        entry = self._fields.pop(key, None)
+        if entry is None:
+            self._misses += 1
+            return None
+        self._fields[key] = entry
+        self._hits += 1
+        return entry[0]
+
+    def put(self, key, distance_field):
+        """
+        Cache field under key, evicts least recently used fields
+        until the cache fits, fields larger than the cache are skipped
+        """
+        size = field_memory_size(distance_field)
+        if size > self._max_bytes:
+            return
+        old_entry = self._fields.pop(key, None)
+        if old_entry is not None:
+            self._bytes -= old_entry[1]
+        while self._bytes + size > self._max_bytes:
+            dummy_key, evicted = self._fields.popitem(last = False)
+            self._bytes -= evicted[1]
+            self._evictions += 1
+        self._fields[key] = (distance_field, size)
+        self._bytes += size
+
+    def stats(self):
+        """
+        Return dictionary with hits, misses, evictions, entries, bytes
+        and max_bytes
+        """
+        return {"hits": self._hits, "misses": self._misses,
+                "evictions": self._evictions, "entries": len(self._fields),
+                "bytes": self._bytes, "max_bytes": self._max_bytes}
+
 
 class Zombie(poc_grid.Grid):
     """
@@ -24,12 +331,37 @@ class Zombie(poc_grid.Grid):
     """
 
     def __init__(self, grid_height, grid_width, obstacle_list = None, 
-                 zombie_list = None, human_list = None):
+                 zombie_list = None, human_list = None, engine = BFS_ENGINE,
+                 incremental = False, batch_moves = False, seed = None,
+                 compact = False, cache_bytes = 0):
         """
         Create a simulation of given size with given obstacles,
         humans, and zombies
+        engine: BFS_ENGINE, NUMPY_ENGINE or COMPACT_ENGINE, used by
+        compute_distance_field
+        incremental: keep distance fields between calls and repair them
+        batch_moves: move all humans or zombies in one numpy pass
+        seed: seed for the random generator used to break ties in moves
+        compact: store obstacles in a TiledBitGrid instead of a list
+        of lists, empty areas cost no memory
+        cache_bytes: memory bound of the LRU cache of distance fields,
+        0 turns the cache off
         """
-        poc_grid.Grid.__init__(self, grid_height, grid_width)
+        if compact:
+            # same attributes as poc_grid.Grid.__init__ without the cells
+            self._grid_height = grid_height
+            self._grid_width = grid_width
+            self._obstacle_bits = TiledBitGrid(grid_height, grid_width)
+        else:
+            poc_grid.Grid.__init__(self, grid_height, grid_width)
+            self._obstacle_bits = None
+        self._obstacle_array = None
+        self._obstacle_version = 0
+        self._incremental = incremental
+        self.set_cache_bytes(cache_bytes)
+        self.set_engine(engine)
+        self.set_batch_moves(batch_moves)
+        self.set_seed(seed)
         if obstacle_list != None:
             for cell in obstacle_list:
                 self.set_full(cell[0], cell[1])
@@ -41,22 +373,160 @@ class Zombie(poc_grid.Grid):
             self._human_list = list(human_list)  
         else:
             self._human_list = []
+        self._zombie_cells = _index_cells(self._zombie_list)
+        self._human_cells = _index_cells(self._human_list)
         
     def clear(self):
         """
         Set cells in obstacle grid to be empty
         Reset zombie and human lists to be empty
         """
-        poc_grid.Grid.clear(self)
+        if self._obstacle_bits is None:
+            poc_grid.Grid.clear(self)
+        else:
+            self._obstacle_bits.clear()
+        self._obstacle_array = None
+        self._obstacle_version += 1
+        self._reset_distance_cache()
         self._zombie_list = []
         self._human_list = []
+        self._zombie_cells = {}
+        self._human_cells = {}
+
+    def __str__(self):
+        """
+        Return multi-line string represenation of obstacle grid
+        """
+        if self._obstacle_bits is None:
+            return poc_grid.Grid.__str__(self)
+        ans = ""
+        for row in range(self.get_grid_height()):
+            ans += str([EMPTY if self.is_empty(row, col) else FULL
+                        for col in range(self.get_grid_width())]) + "\n"
+        return ans
+
+    def is_empty(self, row, col):
+        """
+        Check whether cell with index (row, col) is empty
+        """
+        if self._obstacle_bits is None:
+            return poc_grid.Grid.is_empty(self, row, col)
+        return not self._obstacle_bits.get(row, col)
+
+    def set_full(self, row, col):
+        """
+        Set cell to be an obstacle, keeps numpy obstacle array in sync
+        """
+        if self._obstacle_bits is None:
+            poc_grid.Grid.set_full(self, row, col)
+        else:
+            self._obstacle_bits.set(row, col)
+        if self._obstacle_array is not None:
+            self._obstacle_array[row, col] = True
+        self._record_obstacle_change(row, col)
+
+    def set_empty(self, row, col):
+        """
+        Set cell to be empty, keeps numpy obstacle array in sync
+        """
+        if self._obstacle_bits is None:
+            poc_grid.Grid.set_empty(self, row, col)
+        else:
+            self._obstacle_bits.reset(row, col)
+        if self._obstacle_array is not None:
+            self._obstacle_array[row, col] = False
+        self._record_obstacle_change(row, col)
+
+    def set_engine(self, engine):
+        """
+        Select the engine used by compute_distance_field
+        """
+        assert engine in ENGINES, "unknown engine: " + str(engine)
+        assert engine != NUMPY_ENGINE or numpy != None, \
+               "numpy is not available for " + NUMPY_ENGINE + " engine"
+        self._engine = engine
+        self._reset_distance_cache()
+
+    def get_engine(self):
+        """
+        Return the engine used by compute_distance_field
+        """
+        return self._engine
+
+    def set_batch_moves(self, batch_moves):
+        """
+        Turn batched movement of humans and zombies on or off
+        """
+        assert not batch_moves or numpy != None, \
+               "numpy is not available for batched moves"
+        self._batch_moves = batch_moves
+
+    def set_seed(self, seed):
+        """
+        Reseed the random generator used to break ties in moves
+        """
+        self._random = random.Random(seed)
+
+    def set_incremental(self, incremental):
+        """
+        Turn incremental distance field maintenance on or off
+        """
+        self._incremental = incremental
+        self._reset_distance_cache()
+
+    def set_cache_bytes(self, cache_bytes):
+        """
+        Set memory bound of the LRU cache of distance fields,
+        0 turns the cache off and drops cached fields
+        """
+        if cache_bytes > 0:
+            self._lru_cache = LRUFieldCache(cache_bytes)
+        else:
+            self._lru_cache = None
+
+    def cache_stats(self):
+        """
+        Return LRU cache counters, see LRUFieldCache.stats,
+        or None when the cache is off
+        """
+        if self._lru_cache is None:
+            return None
+        return self._lru_cache.stats()
+
+    def _reset_distance_cache(self):
+        """
+        Forget distance fields kept for incremental maintenance
+        """
+        self._cached_fields = {}
+        self._cached_sources = {}
+        self._obstacle_changes = {}
+
+    def _record_obstacle_change(self, row, col):
+        """
+        Remember toggled obstacle cell for every kept distance field
+        and start a new obstacle layout version
+        """
+        self._obstacle_version += 1
+        for changes in self._obstacle_changes.values():
+            changes.add((row, col))
         
     def add_zombie(self, row, col):
         """
         Add zombie to the zombie list
         """
         self._zombie_list.append((row, col))
+        self._zombie_cells[(row, col)] = self._zombie_cells.get((row, col), 0) + 1
                 
+    def reset_entities(self, zombie_list, human_list):
+        """
+        Replace zombies and humans, obstacles are kept
+        """
+        self._zombie_list = list(zombie_list)
+        self._human_list = list(human_list)
+        self._zombie_cells = _index_cells(self._zombie_list)
+        self._human_cells = _index_cells(self._human_list)
+        self._reset_distance_cache()
+
     def num_zombies(self):
         """
         Return number of zombies
@@ -76,6 +546,7 @@ class Zombie(poc_grid.Grid):
         Add human to the human list
         """
         self._human_list.append((row, col))
+        self._human_cells[(row, col)] = self._human_cells.get((row, col), 0) + 1
         
     def num_humans(self):
         """
@@ -89,12 +560,91 @@ class Zombie(poc_grid.Grid):
         """
         for human in self._human_list:
             yield human
+
+    def zombies_at(self, row, col):
+        """
+        Return number of zombies in cell (row, col)
+        """
+        return self._zombie_cells.get((row, col), 0)
+
+    def humans_at(self, row, col):
+        """
+        Return number of humans in cell (row, col)
+        """
+        return self._human_cells.get((row, col), 0)
+
+    def captured_humans(self):
+        """
+        Return list of cells where humans share a cell with a zombie
+        Work is proportional to the smaller number of occupied cells
+        """
+        if len(self._human_cells) <= len(self._zombie_cells):
+            smaller, larger = self._human_cells, self._zombie_cells
+        else:
+            smaller, larger = self._zombie_cells, self._human_cells
+        return [cell for cell in smaller if cell in larger]
+
+    def count_in_region(self, entity_type, top, left, bottom, right):
+        """
+        Return number of zombies or humans in cells with
+        top <= row <= bottom and left <= col <= right
+        Scans the region or the occupied cells, whichever is smaller
+        """
+        cells = self._zombie_cells if entity_type == ZOMBIE else self._human_cells
+        top, left = max(top, 0), max(left, 0)
+        bottom = min(bottom, self.get_grid_height() - 1)
+        right = min(right, self.get_grid_width() - 1)
+        if bottom < top or right < left:
+            return 0
+        if (bottom - top + 1) * (right - left + 1) < len(cells):
+            return sum(cells.get((row, col), 0)
+                       for row in range(top, bottom + 1)
+                       for col in range(left, right + 1))
+        return sum(count for cell, count in cells.items()
+                   if top <= cell[0] <= bottom and left <= cell[1] <= right)
         
     def compute_distance_field(self, entity_type):
         """
         Function computes a 2D distance field
         Distance at member of entity_queue is zero
         Shortest paths avoid obstacles and use distance_type distances
+        In incremental mode the returned field is kept by the simulation
+        and updated in place by later calls when few cells change, the
+        numpy engine always recomputes since it works on whole arrays
+        Otherwise, with the LRU cache on, fields are memoized by obstacle
+        layout version and source set, cached fields must not be modified
+        """
+        if self._incremental and entity_type in self._cached_fields:
+            distance_field = self._repair_distance_field(entity_type)
+            if distance_field is not None:
+                return distance_field
+        cache_key = None
+        if self._lru_cache is not None and not self._incremental \
+        and entity_type in (HUMAN, ZOMBIE):
+            entity_list = self._zombie_list if entity_type == ZOMBIE else self._human_list
+            cache_key = (self._engine, entity_type, self._obstacle_version,
+                         frozenset(entity_list))
+            distance_field = self._lru_cache.get(cache_key)
+            if distance_field is not None:
+                return distance_field
+        if self._engine == NUMPY_ENGINE:
+            distance_field = self._compute_distance_field_numpy(entity_type)
+        elif self._engine == COMPACT_ENGINE:
+            distance_field = self._compute_distance_field_compact(entity_type)
+        else:
+            distance_field = self._compute_distance_field_bfs(entity_type)
+        if self._incremental and self._engine != NUMPY_ENGINE and distance_field is not None:
+            entity_list = self._zombie_list if entity_type == ZOMBIE else self._human_list
+            self._cached_fields[entity_type] = distance_field
+            self._cached_sources[entity_type] = set(entity_list)
+            self._obstacle_changes[entity_type] = set()
+        if cache_key is not None:
+            self._lru_cache.put(cache_key, distance_field)
+        return distance_field
+
+    def _compute_distance_field_bfs(self, entity_type):
+        """
+        Breadth-first search version of compute_distance_field
         """
         visited = poc_grid.Grid(self.get_grid_height(), self.get_grid_width())
         distance_field = [[self.get_grid_height() * self.get_grid_width()
@@ -123,6 +673,173 @@ class Zombie(poc_grid.Grid):
                     distance_field[neighbor_cell[0]][neighbor_cell[1]] = \
                     distance_field[current_cell[0]][current_cell[1]] + 1
         return distance_field
+
+    def _compute_distance_field_compact(self, entity_type):
+        """
+        Memory saving version of compute_distance_field, visited cells
+        are kept in a TiledBitGrid and the BFS runs level by level
+        Returns a TiledDistanceField with the same values as the BFS engine
+        """
+        if entity_type == ZOMBIE:
+            entity_list = self._zombie_list
+        elif entity_type == HUMAN:
+            entity_list = self._human_list
+        else:
+            print "Wrong entity type provided for compute_distance_field(entity_type)."
+            return
+        visited = TiledBitGrid(self.get_grid_height(), self.get_grid_width())
+        distance_field = TiledDistanceField(self.get_grid_height(), self.get_grid_width())
+        frontier = []
+        for entity in entity_list:
+            if not visited.get(entity[0], entity[1]):
+                visited.set(entity[0], entity[1])
+                distance_field.set(entity[0], entity[1], 0)
+                frontier.append(entity)
+        distance = 0
+        while len(frontier) != 0:
+            distance += 1
+            next_frontier = []
+            for current_cell in frontier:
+                for neighbor_cell in self.four_neighbors(current_cell[0], current_cell[1]):
+                    if not visited.get(neighbor_cell[0], neighbor_cell[1]) \
+                    and self.is_empty(neighbor_cell[0], neighbor_cell[1]):
+                        visited.set(neighbor_cell[0], neighbor_cell[1])
+                        distance_field.set(neighbor_cell[0], neighbor_cell[1], distance)
+                        next_frontier.append(neighbor_cell)
+            frontier = next_frontier
+        return distance_field
+
+    def _get_obstacle_array(self):
+        """
+        Return boolean numpy array of obstacles, True for FULL cells
+        Built from the grid once, then updated by set_full/set_empty
+        """
+        if self._obstacle_array is None:
+            self._obstacle_array = numpy.array(
+                [[not self.is_empty(row, col)
+                  for col in range(self.get_grid_width())]
+                 for row in range(self.get_grid_height())], dtype = bool)
+        return self._obstacle_array
+
+    def _compute_distance_field_numpy(self, entity_type):
+        """
+        Numpy version of compute_distance_field, expands the whole
+        BFS frontier at once with shifted boolean masks
+        Returns a 2D numpy array with the same values as the BFS engine
+        """
+        if entity_type == ZOMBIE:
+            entity_list = self._zombie_list
+        elif entity_type == HUMAN:
+            entity_list = self._human_list
+        else:
+            print "Wrong entity type provided for compute_distance_field(entity_type)."
+            return
+        height, width = self.get_grid_height(), self.get_grid_width()
+        distance_field = numpy.full((height, width), height * width, dtype = numpy.int64)
+        passable = ~self._get_obstacle_array()
+        visited = numpy.zeros((height, width), dtype = bool)
+        if len(entity_list) != 0:
+            rows, cols = zip(*entity_list)
+            visited[list(rows), list(cols)] = True
+            distance_field[visited] = 0
+        frontier = visited.copy()
+        grown = numpy.empty((height, width), dtype = bool)
+        distance = 0
+        while frontier.any():
+            distance += 1
+            grown.fill(False)
+            grown[1:, :] |= frontier[:-1, :]
+            grown[:-1, :] |= frontier[1:, :]
+            grown[:, 1:] |= frontier[:, :-1]
+            grown[:, :-1] |= frontier[:, 1:]
+            frontier = grown & passable & ~visited
+            visited |= frontier
+            distance_field[frontier] = distance
+        return distance_field
+
+    def _repair_distance_field(self, entity_type):
+        """
+        Update kept distance field after sources were added, removed or
+        moved and obstacles were toggled since the last call
+        Cells that lost their shortest path are raised to infinity,
+        then distances are lowered again from the border of the raised
+        region, new sources and emptied cells
+        Work done depends on the size of the affected region only
+        Returns None, leaving the field untouched, when the changes
+        exceed REPAIR_MAX_CHANGES or REPAIR_RAISED_FRACTION and a full
+        recompute is cheaper
+        """
+        distance_field = self._cached_fields[entity_type]
+        old_sources = self._cached_sources[entity_type]
+        changed_cells = self._obstacle_changes[entity_type]
+        entity_list = self._zombie_list if entity_type == ZOMBIE else self._human_list
+        new_sources = set(entity_list)
+        infinity = self.get_grid_height() * self.get_grid_width()
+        if len(old_sources ^ new_sources) + len(changed_cells) > REPAIR_MAX_CHANGES:
+            return None
+        max_raised = infinity // REPAIR_RAISED_FRACTION
+        # a removed source is expected to leave its share of the grid
+        # without a shortest path
+        if len(old_sources - new_sources) * infinity > max_raised * len(old_sources):
+            return None
+
+        # raise phase, cells are processed in order of their old distance
+        raised = set()
+        heap = []
+        for cell in (old_sources - new_sources) | changed_cells:
+            if cell not in new_sources and distance_field[cell[0]][cell[1]] != infinity \
+            and (cell in old_sources or not self.is_empty(cell[0], cell[1])):
+                raised.add(cell)
+                heap.append((distance_field[cell[0]][cell[1]], cell))
+        heapq.heapify(heap)
+        while len(heap) != 0:
+            distance, cell = heapq.heappop(heap)
+            for neighbor_cell in self.four_neighbors(cell[0], cell[1]):
+                if neighbor_cell in raised or neighbor_cell in new_sources \
+                or distance_field[neighbor_cell[0]][neighbor_cell[1]] != distance + 1:
+                    continue
+                supported = False
+                for support_cell in self.four_neighbors(neighbor_cell[0], neighbor_cell[1]):
+                    if support_cell not in raised \
+                    and distance_field[support_cell[0]][support_cell[1]] == distance:
+                        supported = True
+                        break
+                if not supported:
+                    raised.add(neighbor_cell)
+                    heapq.heappush(heap, (distance + 1, neighbor_cell))
+            if len(raised) > max_raised:
+                return None
+        for cell in raised:
+            distance_field[cell[0]][cell[1]] = infinity
+
+        # lower phase, unit weight Dijkstra from the seeds
+        for cell in new_sources - old_sources:
+            distance_field[cell[0]][cell[1]] = 0
+            heap.append((0, cell))
+        for cell in raised | changed_cells:
+            if cell in new_sources or not self.is_empty(cell[0], cell[1]):
+                continue
+            best = infinity
+            for neighbor_cell in self.four_neighbors(cell[0], cell[1]):
+                if neighbor_cell in new_sources or self.is_empty(neighbor_cell[0], neighbor_cell[1]):
+                    best = min(best, distance_field[neighbor_cell[0]][neighbor_cell[1]] + 1)
+            if best < distance_field[cell[0]][cell[1]]:
+                distance_field[cell[0]][cell[1]] = best
+                heap.append((best, cell))
+        heapq.heapify(heap)
+        while len(heap) != 0:
+            distance, cell = heapq.heappop(heap)
+            if distance > distance_field[cell[0]][cell[1]]:
+                continue
+            for neighbor_cell in self.four_neighbors(cell[0], cell[1]):
+                if distance_field[neighbor_cell[0]][neighbor_cell[1]] > distance + 1 \
+                and self.is_empty(neighbor_cell[0], neighbor_cell[1]):
+                    distance_field[neighbor_cell[0]][neighbor_cell[1]] = distance + 1
+                    heapq.heappush(heap, (distance + 1, neighbor_cell))
+
+        self._cached_sources[entity_type] = new_sources
+        self._obstacle_changes[entity_type] = set()
+        return distance_field
     
     def find_best_move(self, entity, distance_field, get_moves, fleeing = False):
         """
@@ -133,35 +850,445 @@ class Zombie(poc_grid.Grid):
         fleeing: True for humans, False for zombies
         """
         compare = max if fleeing else min
-        moves = get_moves(entity[0], entity[1])
-        dist = compare(distance_field[move[0]][move[1]] for move in moves
-                       if self.is_empty(move[0], move[1]))
+        moves = [move for move in get_moves(entity[0], entity[1])
+                 if self.is_empty(move[0], move[1])]
+        if len(moves) == 0:
+            return entity
+        dist = compare(distance_field[move[0]][move[1]] for move in moves)
         best_moves = [move for move in moves if distance_field[move[0]][move[1]] == dist]
         if not fleeing and dist > distance_field[entity[0]][entity[1]] \
         or fleeing and dist < distance_field[entity[0]][entity[1]]:
             return entity
         else:
-            return random.choice(best_moves)
+            return self._choose(best_moves)
+
+    def _choose(self, moves):
+        """
+        Pick random move, consumes exactly one draw from the generator
+        so that batched and per entity moves give the same results
+        """
+        return moves[int(self._random.random() * len(moves))]
+
+    def find_best_moves(self, entity_list, distance_field, offsets, fleeing = False):
+        """
+        Batched version of find_best_move for a whole entity list
+        offsets: FOUR_OFFSETS or EIGHT_OFFSETS
+        Returns a new list of entities, equal to calling find_best_move
+        for every entity in order with the same random generator state
+        """
+        if len(entity_list) == 0:
+            return []
+        height, width = self.get_grid_height(), self.get_grid_width()
+        offsets = numpy.array(offsets)
+        positions = numpy.array(entity_list)
+        rows = positions[:, 0:1] + offsets[:, 0]
+        cols = positions[:, 1:2] + offsets[:, 1]
+        inside = (rows >= 0) & (rows < height) & (cols >= 0) & (cols < width)
+        rows_inside, cols_inside = rows.clip(0, height - 1), cols.clip(0, width - 1)
+        if isinstance(distance_field, TiledDistanceField):
+            # compact storage, only look up the cells around the entities
+            cells = zip(rows_inside.ravel().tolist(), cols_inside.ravel().tolist())
+            passable = inside & numpy.array([self.is_empty(row, col) for row, col in cells],
+                                            dtype = bool).reshape(rows.shape)
+            values = numpy.array([distance_field.get(row, col) for row, col in cells],
+                                 dtype = numpy.int64).reshape(rows.shape)
+            own = numpy.array([distance_field.get(entity[0], entity[1])
+                               for entity in entity_list], dtype = numpy.int64)
+        else:
+            distance_field = numpy.asarray(distance_field)
+            passable = inside & ~self._get_obstacle_array()[rows_inside, cols_inside]
+            values = distance_field[rows_inside, cols_inside]
+            own = distance_field[positions[:, 0], positions[:, 1]]
+        if fleeing:
+            best = numpy.where(passable, values, -1).max(axis = 1)
+            stay = best < own
+        else:
+            best = numpy.where(passable, values, height * width + 1).min(axis = 1)
+            stay = best > own
+        movers = numpy.nonzero(passable.any(axis = 1) & ~stay)[0]
+        candidates = passable[movers] & (values[movers] == best[movers, None])
+        draws = numpy.array([self._random.random() for dummy_mover in movers])
+        picks = (draws * candidates.sum(axis = 1)).astype(int)
+        choice = (candidates.cumsum(axis = 1) > picks[:, None]).argmax(axis = 1)
+        positions[movers, 0] = rows[movers, choice]
+        positions[movers, 1] = cols[movers, choice]
+        return [tuple(position) for position in positions.tolist()]
             
     def move_humans(self, zombie_distance):
         """
         Function that moves humans away from zombies, diagonal moves
         are allowed
         """
+        if self._batch_moves:
+            new_list = self.find_best_moves(self._human_list, zombie_distance,
+                                            EIGHT_OFFSETS, True)
+            for old_cell, new_cell in zip(self._human_list, new_list):
+                if old_cell != new_cell:
+                    _move_occupant(self._human_cells, old_cell, new_cell)
+            self._human_list = new_list
+            return
         for human_ind in range(len(self._human_list)):
-            self._human_list[human_ind] = self.find_best_move(self._human_list[human_ind],
-                                                              zombie_distance,
-                                                              self.eight_neighbors, True)
+            old_cell = self._human_list[human_ind]
+            new_cell = self.find_best_move(old_cell, zombie_distance,
+                                           self.eight_neighbors, True)
+            if old_cell != new_cell:
+                _move_occupant(self._human_cells, old_cell, new_cell)
+            self._human_list[human_ind] = new_cell
     
     def move_zombies(self, human_distance):
         """
         Function that moves zombies towards humans, no diagonal moves
         are allowed
         """
+        if self._batch_moves:
+            new_list = self.find_best_moves(self._zombie_list, human_distance,
+                                            FOUR_OFFSETS, False)
+            for old_cell, new_cell in zip(self._zombie_list, new_list):
+                if old_cell != new_cell:
+                    _move_occupant(self._zombie_cells, old_cell, new_cell)
+            self._zombie_list = new_list
+            return
         for zombie_ind in range(len(self._zombie_list)):
-            self._zombie_list[zombie_ind] = self.find_best_move(self._zombie_list[zombie_ind],
-                                                                human_distance,
-                                                                self.four_neighbors, False)
+            old_cell = self._zombie_list[zombie_ind]
+            new_cell = self.find_best_move(old_cell, human_distance,
+                                           self.four_neighbors, False)
+            if old_cell != new_cell:
+                _move_occupant(self._zombie_cells, old_cell, new_cell)
+            self._zombie_list[zombie_ind] = new_cell
+
+
+def _index_cells(entity_list):
+    """
+    Build occupancy index, a dictionary from cell to number of
+    entities in it
+    """
+    cells = {}
+    for entity in entity_list:
+        cell = tuple(entity)
+        cells[cell] = cells.get(cell, 0) + 1
+    return cells
+
+
+def _move_occupant(cells, old_cell, new_cell):
+    """
+    Move one entity from old_cell to new_cell in occupancy index
+    """
+    old_cell, new_cell = tuple(old_cell), tuple(new_cell)
+    count = cells[old_cell] - 1
+    if count == 0:
+        del cells[old_cell]
+    else:
+        cells[old_cell] = count
+    cells[new_cell] = cells.get(new_cell, 0) + 1
+
+
+############################################################
+# Headless simulation and benchmarks
+
+# default benchmark sweep
+BENCH_SIZES = (50, 100, 200)
+BENCH_DENSITIES = (0.0, 0.2)
+BENCH_ENTITIES = ((10, 100), (100, 1000))
+BENCH_TICKS = 10
+
+
+def random_world(grid_height, grid_width, obstacle_density, num_zombies,
+                 num_humans, seed = None, **options):
+    """
+    Create a Zombie simulation with random obstacles and entities,
+    entities are placed on empty cells only
+    options are passed to the Zombie constructor
+    Returns a Zombie object
+    """
+    rand = random.Random(seed)
+    simulation = Zombie(grid_height, grid_width, seed = seed, **options)
+
+    def random_empty_cell():
+        """
+        Draw random cells until an empty one comes up
+        """
+        while True:
+            cell = (rand.randrange(grid_height), rand.randrange(grid_width))
+            if simulation.is_empty(cell[0], cell[1]):
+                return cell
+
+    # cells are drawn one by one, a list of every cell would dominate
+    # the memory of large worlds
+    num_obstacles = min(int(obstacle_density * grid_height * grid_width),
+                        grid_height * grid_width - 1)
+    for dummy_idx in range(num_obstacles):
+        cell = random_empty_cell()
+        simulation.set_full(cell[0], cell[1])
+    for dummy_idx in range(num_zombies):
+        cell = random_empty_cell()
+        simulation.add_zombie(cell[0], cell[1])
+    for dummy_idx in range(num_humans):
+        cell = random_empty_cell()
+        simulation.add_human(cell[0], cell[1])
+    return simulation
+
+
+def step(simulation, timings = None):
+    """
+    Advance simulation by one tick: compute both distance fields,
+    move humans, then move zombies
+    timings: optional dictionary, time spent in "distance" and
+    "movement" phases is added to it
+    Returns list of cells where humans were captured by zombies
+    """
+    start = time.time()
+    zombie_distance = simulation.compute_distance_field(ZOMBIE)
+    human_distance = simulation.compute_distance_field(HUMAN)
+    middle = time.time()
+    simulation.move_humans(zombie_distance)
+    simulation.move_zombies(human_distance)
+    end = time.time()
+    if timings != None:
+        timings["distance"] = timings.get("distance", 0.0) + middle - start
+        timings["movement"] = timings.get("movement", 0.0) + end - middle
+    return simulation.captured_humans()
+
+
+def run_simulation(simulation, num_ticks):
+    """
+    Run simulation for num_ticks ticks without gui
+    Returns a dictionary with ticks, total time, ticks per second,
+    time spent in each phase and number of captured humans, a human
+    is counted once however many ticks it shares a cell with a zombie
+    """
+    timings = {"distance": 0.0, "movement": 0.0}
+    # humans keep their index in the human list across moves
+    captured = set()
+    start = time.time()
+    for dummy_tick in range(num_ticks):
+        if len(step(simulation, timings)) != 0:
+            for human_ind, human in enumerate(simulation.humans()):
+                if simulation.zombies_at(human[0], human[1]) > 0:
+                    captured.add(human_ind)
+    elapsed = time.time() - start
+    captures = len(captured)
+    return {"ticks": num_ticks,
+            "seconds": elapsed,
+            "ticks_per_second": num_ticks / elapsed if elapsed > 0 else float("inf"),
+            "distance_seconds": timings["distance"],
+            "movement_seconds": timings["movement"],
+            "captures": captures}
+
+
+def peak_memory_kb():
+    """
+    Return peak resident memory of the current process in kilobytes
+    """
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, Linux reports kilobytes
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def benchmark_case(case):
+    """
+    Run one benchmark case, a dictionary with height, width, density,
+    zombies, humans, ticks, seed and Zombie constructor options
+    Returns the case updated with run_simulation results and peak memory
+    """
+    simulation = random_world(case["height"], case["width"], case["density"],
+                              case["zombies"], case["humans"], case["seed"],
+                              **case["options"])
+    result = dict(case)
+    result.update(run_simulation(simulation, case["ticks"]))
+    result["peak_memory_kb"] = peak_memory_kb()
+    return result
+
+
+def run_benchmarks(sizes = BENCH_SIZES, densities = BENCH_DENSITIES,
+                   entities = BENCH_ENTITIES, num_ticks = BENCH_TICKS,
+                   seed = 0, **options):
+    """
+    Generator that sweeps grid size, obstacle density and
+    (zombies, humans) counts and yields benchmark_case results
+    Every case runs in a fresh worker process so that peak memory
+    is measured per case
+    """
+    import multiprocessing
+    cases = [{"height": size, "width": size, "density": density,
+              "zombies": num_zombies, "humans": num_humans,
+              "ticks": num_ticks, "seed": seed, "options": options}
+             for size in sizes for density in densities
+             for num_zombies, num_humans in entities]
+    pool = multiprocessing.Pool(processes = 1, maxtasksperchild = 1)
+    try:
+        for result in pool.imap(benchmark_case, cases):
+            yield result
+    finally:
+        pool.terminate()
+
+
+def format_result(result):
+    """
+    Format simulation or benchmark result as a single line
+    """
+    ans = ""
+    for key in ("height", "width", "density", "zombies", "humans"):
+        if key in result:
+            ans += key + "=" + str(result[key]) + " "
+    ans += "ticks=%d ticks/s=%.2f distance=%.3fs movement=%.3fs" \
+           % (result["ticks"], result["ticks_per_second"],
+              result["distance_seconds"], result["movement_seconds"])
+    if "captures" in result:
+        ans += " captures=%d" % result["captures"]
+    if "peak_memory_kb" in result:
+        ans += " peak_memory=%dkB" % result["peak_memory_kb"]
+    return ans
+
+
+############################################################
+# Parameter sweeps over a process pool
+
+# per worker process simulation, created by _init_sweep_worker
+_SWEEP_SIMULATION = None
+
+
+def _init_sweep_worker(grid_height, grid_width, shared_obstacles, options):
+    """
+    Pool initializer, builds the worker's simulation once from the
+    obstacle grid in shared memory
+    """
+    global _SWEEP_SIMULATION
+    obstacle_list = [(idx // grid_width, idx % grid_width)
+                     for idx in range(grid_height * grid_width)
+                     if shared_obstacles[idx]]
+    _SWEEP_SIMULATION = Zombie(grid_height, grid_width, obstacle_list, **options)
+
+
+def _run_sweep_scenario(task):
+    """
+    Run one scenario in a worker process
+    task: (index, zombie_list, human_list, num_ticks, seed)
+    Returns (index, summary dictionary)
+    """
+    index, zombie_list, human_list, num_ticks, seed = task
+    simulation = _SWEEP_SIMULATION
+    simulation.reset_entities(zombie_list, human_list)
+    simulation.set_seed(seed)
+    summary = run_simulation(simulation, num_ticks)
+    zombie_distance = simulation.compute_distance_field(ZOMBIE)
+    summary["zombies"] = simulation.num_zombies()
+    summary["humans"] = simulation.num_humans()
+    summary["min_human_distance"] = min([zombie_distance[human[0]][human[1]]
+                                         for human in simulation.humans()] or [None])
+    return index, summary
+
+
+def sweep(grid_height, grid_width, obstacle_list, scenarios, num_ticks,
+          processes = None, seed = 0, chunksize = 1, **options):
+    """
+    Generator that runs independent scenarios on the same obstacle
+    layout across a process pool
+    scenarios: iterable of (zombie_list, human_list) pairs
+    The obstacle grid is put in shared memory once and every worker
+    builds its simulation from it, only entity lists are sent per task
+    Yields (scenario index, summary) pairs as scenarios finish
+    """
+    import multiprocessing
+    shared_obstacles = multiprocessing.RawArray("b", grid_height * grid_width)
+    for cell in obstacle_list:
+        shared_obstacles[cell[0] * grid_width + cell[1]] = 1
+    tasks = ((index, list(scenario[0]), list(scenario[1]), num_ticks, seed + index)
+             for index, scenario in enumerate(scenarios))
+    pool = multiprocessing.Pool(processes, _init_sweep_worker,
+                                (grid_height, grid_width, shared_obstacles, options))
+    try:
+        for result in pool.imap_unordered(_run_sweep_scenario, tasks, chunksize):
+            yield result
+    finally:
+        pool.terminate()
+
+
+def random_scenarios(simulation, num_scenarios, num_zombies, num_humans, seed = None):
+    """
+    Generator of random (zombie_list, human_list) pairs placed on the
+    empty cells of simulation
+    """
+    rand = random.Random(seed)
+    empty_cells = [(row, col) for row in range(simulation.get_grid_height())
+                   for col in range(simulation.get_grid_width())
+                   if simulation.is_empty(row, col)]
+    for dummy_idx in range(num_scenarios):
+        yield ([rand.choice(empty_cells) for dummy_zombie in range(num_zombies)],
+               [rand.choice(empty_cells) for dummy_human in range(num_humans)])
+
+
+def main(argv):
+    """
+    Command line entry point
+    run: simulate a random world for a number of ticks
+    bench: run the benchmark sweep
+    sweep: run random scenarios on one random world across a process pool
+    """
+    import argparse
+    parser = argparse.ArgumentParser(description = "Headless Zombie Apocalypse")
+    parser.add_argument("command", choices = ("run", "bench", "sweep"))
+    parser.add_argument("--height", type = int, default = 100)
+    parser.add_argument("--width", type = int, default = 100)
+    parser.add_argument("--density", type = float, default = 0.2)
+    parser.add_argument("--zombies", type = int, default = 10)
+    parser.add_argument("--humans", type = int, default = 100)
+    parser.add_argument("--ticks", type = int, default = BENCH_TICKS)
+    parser.add_argument("--seed", type = int, default = 0)
+    parser.add_argument("--engine", choices = ENGINES, default = BFS_ENGINE)
+    parser.add_argument("--incremental", action = "store_true")
+    parser.add_argument("--batch-moves", action = "store_true")
+    parser.add_argument("--compact", action = "store_true",
+                        help = "store obstacles in tiled bit grids")
+    parser.add_argument("--cache-bytes", type = int, default = 0,
+                        help = "memory bound of the distance field cache")
+    parser.add_argument("--sizes", default = ",".join(str(size) for size in BENCH_SIZES),
+                        help = "bench grid sizes, e.g. 50,100")
+    parser.add_argument("--densities", default = ",".join(str(dens) for dens in BENCH_DENSITIES),
+                        help = "bench obstacle densities, e.g. 0,0.2")
+    parser.add_argument("--entities", default = ",".join("%d:%d" % counts for counts in BENCH_ENTITIES),
+                        help = "bench zombies:humans counts, e.g. 10:100,100:1000")
+    parser.add_argument("--scenarios", type = int, default = 100,
+                        help = "number of sweep scenarios")
+    parser.add_argument("--processes", type = int, default = None,
+                        help = "sweep worker processes, defaults to cpu count")
+    args = parser.parse_args(argv)
+    options = {"engine": args.engine, "incremental": args.incremental,
+               "batch_moves": args.batch_moves, "compact": args.compact,
+               "cache_bytes": args.cache_bytes}
+    if args.command == "run":
+        simulation = random_world(args.height, args.width, args.density,
+                                  args.zombies, args.humans, args.seed, **options)
+        result = run_simulation(simulation, args.ticks)
+        result["peak_memory_kb"] = peak_memory_kb()
+        print format_result(result)
+        if simulation.cache_stats() != None:
+            print "cache", simulation.cache_stats()
+    elif args.command == "sweep":
+        world = random_world(args.height, args.width, args.density, 0, 0, args.seed)
+        obstacle_list = [(row, col) for row in range(args.height)
+                         for col in range(args.width) if not world.is_empty(row, col)]
+        scenarios = random_scenarios(world, args.scenarios, args.zombies,
+                                     args.humans, args.seed)
+        start = time.time()
+        for index, summary in sweep(args.height, args.width, obstacle_list, scenarios,
+                                    args.ticks, args.processes, args.seed, **options):
+            print "scenario=%d" % index, format_result(summary), \
+                  "min_human_distance=" + str(summary["min_human_distance"])
+            sys.stdout.flush()
+        print "scenarios/s=%.2f" % (args.scenarios / (time.time() - start))
+    else:
+        sizes = [int(size) for size in args.sizes.split(",")]
+        densities = [float(dens) for dens in args.densities.split(",")]
+        entities = [tuple(int(count) for count in counts.split(":"))
+                    for counts in args.entities.split(",")]
+        for result in run_benchmarks(sizes, densities, entities, args.ticks,
+                                     args.seed, **options):
+            print format_result(result)
+            sys.stdout.flush()
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
 
 # Start up gui for simulation - You will need to write some code above
 # before this will work without errors
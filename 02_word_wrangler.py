@@ -2,13 +2,31 @@
 Student code for Word Wrangler game
 """
 
+import sys
+import time
 import urllib2
+from array import array
 import codeskulptor
 import poc_wrangler_provided as provided
 
 WORDFILE = "assets_scrabble_words3.txt"
 codeskulptor.set_timeout(50)
 
+# marker for "no previous element" in streaming functions
+_NOTHING = object()
+# default number of words per sorted run in external_sort
+RUN_SIZE = 100000
+# external_sort merges at most this many runs at once, so that open
+# files stay well below descriptor limits, even a limit of 64
+MERGE_FAN_IN = 32
+
+# compiled word list cache: header, optional first letter index,
+# word offsets and word bytes, see compile_words
+CACHE_MAGIC = "WWDC"
+CACHE_VERSION = 1
+CACHE_SUFFIX = ".wwdc"
+CACHE_HEADER = "<4sIdqII" # magic, version, source mtime, source size, words, has index
+
 # Functions to manipulate ordered word lists
 
 def remove_duplicates(list1):
@@ -20,7 +38,20 @@ def remove_duplicates(list1):
 
     This function can be iterative.
     """
-    return [list1[ind] for ind in range(len(list1)) if list1[ind] not in list1[:ind]]
+    return list(iter_remove_duplicates(list1))
+
+def iter_remove_duplicates(iterable):
+    """
+    Generator version of remove_duplicates for any sorted iterable.
+
+    Yields each element once, keeps only the previous element in
+    memory.
+    """
+    previous = _NOTHING
+    for item in iterable:
+        if previous is _NOTHING or item != previous:
+            yield item
+            previous = item
 
 def intersect(list1, list2):
     """
@@ -31,15 +62,28 @@ def intersect(list1, list2):
 
     This function can be iterative.
     """
-#    lst1, lst2 = list(list1), list(list2)
-#    result = []
-#    while len(lst1) != 0 and len(lst2) != 0:
-#        if lst1[0] in lst2:
-#            result.append(lst1.pop(0))
-#        elif lst2[0] in lst2:
-#            result.append(lst2.pop(0))
-#    return result
-    return [el1 for el1 in list1 for el2 in list2 if el1 == el2]
+    return list(iter_intersect(list1, list2))
+
+def iter_intersect(iterable1, iterable2):
+    """
+    Generator version of intersect for any two sorted iterables.
+
+    Walks both inputs once, an element that appears several times
+    in both is yielded as many times as it appears in the shorter run.
+    """
+    iter1, iter2 = iter(iterable1), iter(iterable2)
+    try:
+        item1, item2 = next(iter1), next(iter2)
+        while True:
+            if item1 < item2:
+                item1 = next(iter1)
+            elif item2 < item1:
+                item2 = next(iter2)
+            else:
+                yield item1
+                item1, item2 = next(iter1), next(iter2)
+    except StopIteration:
+        return
 
 # Functions to perform merge sort
 
@@ -52,11 +96,18 @@ def merge(list1, list2):
 
     This function can be iterative.
     """
-    lst1, lst2 = list(list1), list(list2)
     result = []
-    while len(lst1) != 0 and len(lst2) != 0:
-        result.append(lst1.pop(0) if lst1[0] < lst2[0] else lst2.pop(0))        
-    return result + lst1 + lst2 # one of them should be empty by now
+    ind1, ind2 = 0, 0
+    while ind1 < len(list1) and ind2 < len(list2):
+        if list2[ind2] < list1[ind1]:
+            result.append(list2[ind2])
+            ind2 += 1
+        else:
+            result.append(list1[ind1])
+            ind1 += 1
+    result.extend(list1[ind1:]) # one of them is empty by now
+    result.extend(list2[ind2:])
+    return result
                 
 def merge_sort(list1):
     """
@@ -66,14 +117,108 @@ def merge_sort(list1):
 
     This function should be recursive.
     """
-    if len(list1) <= 1:
-        return list1
-    half1, half2 = list1[:len(list1)/2], list1[len(list1)/2:]
-    if half1[0] < half2[0]:
-        left, right = half1, half2
-    else:
-        left, right = half2, half1
-    return merge(merge_sort(left), merge_sort(right))
+    result = list(list1)
+    _merge_sort_range(result, 0, len(result), [None] * len(result))
+    return result
+
+def _merge_sort_range(items, low, high, buffer):
+    """
+    Sort items[low:high] in place, buffer is scratch space of the
+    same length as items shared by all levels of recursion.
+    """
+    if high - low <= 1:
+        return
+    middle = (low + high) // 2
+    _merge_sort_range(items, low, middle, buffer)
+    _merge_sort_range(items, middle, high, buffer)
+    if not items[middle] < items[middle - 1]: # halves already in order
+        return
+    ind1, ind2, out = low, middle, low
+    while ind1 < middle and ind2 < high:
+        if items[ind2] < items[ind1]:
+            buffer[out] = items[ind2]
+            ind2 += 1
+        else:
+            buffer[out] = items[ind1]
+            ind1 += 1
+        out += 1
+    while ind1 < middle:
+        buffer[out] = items[ind1]
+        ind1 += 1
+        out += 1
+    # the rest of the right half is already in place
+    items[low:out] = buffer[low:out]
+
+def external_sort(in_path, out_path, run_size = RUN_SIZE, tmp_dir = None,
+                  fan_in = MERGE_FAN_IN):
+    """
+    Sort a word file that may not fit in memory.
+
+    Reads in_path in runs of run_size words, sorts every run with
+    merge_sort and writes it to a temporary file, then k-way merges
+    the runs into out_path. With more than fan_in runs, groups of
+    fan_in runs are first merged into longer runs until the rest fit
+    in one merge. At most run_size words and fan_in files are in use.
+
+    Returns a dictionary with words, runs, bytes_read and
+    bytes_written, counting the temporary files too.
+    """
+    import heapq
+    import os
+    assert fan_in >= 2, "fan_in must be at least 2"
+    stats = {"words": 0, "runs": 0, "bytes_read": 0, "bytes_written": 0}
+    run_paths = []
+    try:
+        run = []
+        for word in _read_counted(in_path, stats):
+            run.append(word)
+            if len(run) == run_size:
+                run_paths.append(_write_run(merge_sort(run), tmp_dir, stats))
+                run = []
+        if len(run) != 0 or len(run_paths) == 0:
+            run_paths.append(_write_run(merge_sort(run), tmp_dir, stats))
+        stats["runs"] = len(run_paths)
+        # every temporary file still on disk stays in run_paths
+        while len(run_paths) > fan_in:
+            group = run_paths[:fan_in]
+            merged_path = _write_run(heapq.merge(*[_read_counted(path, stats)
+                                                   for path in group]), tmp_dir, stats)
+            run_paths = run_paths[fan_in:] + [merged_path]
+            for path in group:
+                os.remove(path)
+        merged = heapq.merge(*[_read_counted(path, stats) for path in run_paths])
+        with open(out_path, "w") as out_file:
+            for word in merged:
+                out_file.write(word + "\n")
+                stats["bytes_written"] += len(word) + 1
+                stats["words"] += 1
+    finally:
+        for path in run_paths:
+            os.remove(path)
+    return stats
+
+def _read_counted(path, stats):
+    """
+    Generator of words in a local file, adds bytes read to stats.
+    """
+    with open(path) as wfile:
+        for line in wfile:
+            stats["bytes_read"] += len(line)
+            yield line.rstrip("\r\n")
+
+def _write_run(words, tmp_dir, stats):
+    """
+    Write sorted run to a new temporary file, adds bytes written to
+    stats. Returns the path of the file.
+    """
+    import os
+    import tempfile
+    handle, path = tempfile.mkstemp(suffix = ".run", dir = tmp_dir)
+    with os.fdopen(handle, "w") as run_file:
+        for word in words:
+            run_file.write(word + "\n")
+            stats["bytes_written"] += len(word) + 1
+    return path
 
 
 # Function to generate all strings for the word wrangler game
@@ -98,6 +243,200 @@ def gen_all_strings(word):
                       for string in rest_strings for ind in range(len(string) + 1)
                       if len(string) > 0] + rest_strings
 
+def iter_all_strings(word, min_length = 0, max_length = None):
+    """
+    Generator version of gen_all_strings.
+
+    Yields every distinct string that can be composed from the
+    letters in word exactly once, in sorted order, keeping only the
+    current prefix and letter counts in memory. Only strings with
+    min_length <= len(string) <= max_length are yielded.
+    """
+    letters = sorted(set(word))
+    counts = [word.count(letter) for letter in letters]
+    if max_length == None:
+        max_length = len(word)
+    return _iter_strings("", letters, counts, min_length, max_length)
+
+def _iter_strings(prefix, letters, counts, min_length, max_length):
+    """
+    Recursive helper for iter_all_strings, yields prefix and all its
+    extensions with the remaining letter counts.
+    """
+    if len(prefix) >= min_length:
+        yield prefix
+    if len(prefix) == max_length:
+        return
+    for ind in range(len(letters)):
+        if counts[ind] > 0:
+            counts[ind] -= 1
+            for string in _iter_strings(prefix + letters[ind], letters, counts,
+                                        min_length, max_length):
+                yield string
+            counts[ind] += 1
+
+def find_words(word_list, word, min_length = 1):
+    """
+    Return sorted list of words from sorted word_list that can be
+    composed from the letters in word, without building and sorting
+    the list of all strings.
+    """
+    return list(iter_intersect(word_list, iter_all_strings(word, min_length)))
+
+# Functions to find words through letter signatures
+
+def word_signature(word):
+    """
+    Return letter-count signature of word, its letters in sorted
+    order. Anagrams share the same signature.
+    """
+    return "".join(sorted(word))
+
+def build_anagram_index(word_list):
+    """
+    Build index of word_list, a dictionary from signature to the
+    sorted list of words with that signature.
+    """
+    index = {}
+    for word in word_list:
+        index.setdefault(word_signature(word), []).append(word)
+    for words in index.values():
+        words.sort()
+    return index
+
+def anagram_words(index, word, min_length = 1):
+    """
+    Return sorted list of indexed words that can be composed from
+    the letters in word, looking up every sub-multiset of its letters
+    instead of checking every permutation.
+    """
+    letters = sorted(set(word))
+    counts = [word.count(letter) for letter in letters]
+    result = []
+    for signature in _iter_signatures(letters, counts, 0, ""):
+        if len(signature) >= min_length and signature in index:
+            result.extend(index[signature])
+    result.sort()
+    return result
+
+def _iter_signatures(letters, counts, ind, prefix):
+    """
+    Recursive helper for anagram_words, yields the signatures of
+    all sub-multisets of letters[ind:] with counts[ind:] appended to
+    prefix.
+    """
+    if ind == len(letters):
+        yield prefix
+        return
+    for count in range(counts[ind] + 1):
+        for signature in _iter_signatures(letters, counts, ind + 1,
+                                          prefix + letters[ind] * count):
+            yield signature
+
+# Trie of the word list for pruned word generation
+
+class WordTrie:
+    """
+    Compact trie of a sorted word list, nodes are stored in flat
+    arrays instead of one dictionary per node
+    Children of a node are consecutive nodes sorted by letter
+    """
+
+    def __init__(self, word_list):
+        """
+        Build trie from sorted word_list of single byte characters,
+        nodes are numbered breadth first with the root at 0
+        """
+        self._first_child = array("i")
+        self._num_children = array("i")
+        self._labels = bytearray([0])
+        self._terminal = bytearray([0])
+        self._visits = 0
+        ranges = [(0, len(word_list), 0)]
+        node = 0
+        while node < len(ranges):
+            low, high, depth = ranges[node]
+            while low < high and len(word_list[low]) == depth:
+                self._terminal[node] = 1
+                low += 1
+            self._first_child.append(len(ranges))
+            ind = low
+            while ind < high:
+                letter = word_list[ind][depth]
+                end = ind + 1
+                while end < high and word_list[end][depth] == letter:
+                    end += 1
+                ranges.append((ind, end, depth + 1))
+                self._labels.append(ord(letter))
+                self._terminal.append(0)
+                ind = end
+            self._num_children.append(len(ranges) - self._first_child[node])
+            ranges[node] = None
+            node += 1
+
+    def num_nodes(self):
+        """
+        Return number of nodes
+        """
+        return len(self._labels)
+
+    def get_visits(self):
+        """
+        Return number of nodes visited by words_from since the last
+        reset_visits
+        """
+        return self._visits
+
+    def reset_visits(self):
+        """
+        Reset node visit counter
+        """
+        self._visits = 0
+
+    def contains(self, word):
+        """
+        Return True if word is in the trie
+        """
+        node = 0
+        for letter in word:
+            code = ord(letter)
+            first = self._first_child[node]
+            for child in range(first, first + self._num_children[node]):
+                if self._labels[child] == code:
+                    node = child
+                    break
+            else:
+                return False
+        return self._terminal[node] == 1
+
+    def words_from(self, word, min_length = 1):
+        """
+        Generator of trie words that can be composed from the letters
+        in word, in sorted order
+        Walks the trie together with the remaining letter counts, a
+        prefix that is not in the trie is never extended
+        """
+        counts = [0] * 256
+        for letter in word:
+            counts[ord(letter)] += 1
+        return self._walk(0, "", counts, min_length)
+
+    def _walk(self, node, prefix, counts, min_length):
+        """
+        Recursive helper for words_from
+        """
+        self._visits += 1
+        if self._terminal[node] == 1 and len(prefix) >= min_length:
+            yield prefix
+        first = self._first_child[node]
+        for child in range(first, first + self._num_children[node]):
+            code = self._labels[child]
+            if counts[code] > 0:
+                counts[code] -= 1
+                for found in self._walk(child, prefix + chr(code), counts, min_length):
+                    yield found
+                counts[code] += 1
+
 # Function to load words from a file
 
 def load_words(filename):
@@ -109,6 +448,255 @@ def load_words(filename):
     dfile = urllib2.urlopen(codeskulptor.file2url(filename))
     return [line[:-1] for line in dfile.readlines()]
 
+def iter_word_file(path):
+    """
+    Generator that reads words from a local file line by line.
+
+    Yields strings without the line ending, the file is never
+    loaded in memory at once.
+    """
+    with open(path) as wfile:
+        for line in wfile:
+            yield line.rstrip("\r\n")
+
+# Compiled on-disk word list
+
+def compile_words(source_path, cache_path, with_index = True):
+    """
+    Compile the word file source_path into the binary cache file
+    cache_path: sorted unique words, their offsets and optionally an
+    index of where each first letter starts.
+
+    The source modification time and size are stored so that stale
+    caches can be detected.
+    """
+    import os
+    import struct
+    source_stat = os.stat(source_path)
+    words = remove_duplicates(merge_sort(list(iter_word_file(source_path))))
+    offsets = array("I", [0])
+    for word in words:
+        offsets.append(offsets[-1] + len(word))
+    tmp_path = cache_path + ".tmp"
+    with open(tmp_path, "wb") as cache_file:
+        cache_file.write(struct.pack(CACHE_HEADER, CACHE_MAGIC, CACHE_VERSION,
+                                     source_stat.st_mtime, source_stat.st_size,
+                                     len(words), 1 if with_index else 0))
+        if with_index:
+            # starts[code] is the first word starting with chr(code) or later
+            starts = array("I", [len(words)] * 257)
+            for ind in range(len(words) - 1, -1, -1):
+                if words[ind]:
+                    starts[ord(words[ind][0])] = ind
+            for code in range(255, -1, -1):
+                starts[code] = min(starts[code], starts[code + 1])
+            cache_file.write(_little_endian(starts).tostring())
+        cache_file.write(_little_endian(offsets).tostring())
+        cache_file.write("".join(words))
+    os.rename(tmp_path, cache_path)
+
+def _little_endian(values):
+    """
+    Return copy of unsigned int array in little endian byte order.
+    """
+    values = array("I", values)
+    if sys.byteorder != "little":
+        values.byteswap()
+    return values
+
+class MappedWordList:
+    """
+    Sorted word list read directly from a memory-mapped cache file
+    written by compile_words, words are only decoded when accessed
+    """
+
+    def __init__(self, cache_path):
+        """
+        Map cache_path in memory, raises ValueError for files that
+        are not word list caches
+        """
+        import mmap
+        import struct
+        self._file = open(cache_path, "rb")
+        self._buffer = mmap.mmap(self._file.fileno(), 0, access = mmap.ACCESS_READ)
+        header_size = struct.calcsize(CACHE_HEADER)
+        if len(self._buffer) < header_size:
+            self.close()
+            raise ValueError("not a word list cache: " + cache_path)
+        magic, version, self._source_mtime, self._source_size, self._count, \
+            has_index = struct.unpack_from(CACHE_HEADER, self._buffer, 0)
+        if magic != CACHE_MAGIC or version != CACHE_VERSION:
+            self.close()
+            raise ValueError("not a word list cache: " + cache_path)
+        self._index_start = header_size if has_index else None
+        self._offsets_start = header_size + (257 * 4 if has_index else 0)
+        self._words_start = self._offsets_start + (self._count + 1) * 4
+        self._unpack = struct.Struct("<I").unpack_from
+
+    def matches_source(self, source_path):
+        """
+        Return True if the cache was compiled from source_path as it
+        is now, judged by modification time and size
+        """
+        import os
+        source_stat = os.stat(source_path)
+        return self._source_mtime == source_stat.st_mtime \
+               and self._source_size == source_stat.st_size
+
+    def close(self):
+        """
+        Unmap and close the cache file
+        """
+        self._buffer.close()
+        self._file.close()
+
+    def __len__(self):
+        """
+        Return number of words
+        """
+        return self._count
+
+    def __getitem__(self, ind):
+        """
+        Return word number ind in sorted order
+        """
+        if ind < 0:
+            ind += self._count
+        if not 0 <= ind < self._count:
+            raise IndexError("word index out of range")
+        start = self._unpack(self._buffer, self._offsets_start + 4 * ind)[0]
+        end = self._unpack(self._buffer, self._offsets_start + 4 * ind + 4)[0]
+        return self._buffer[self._words_start + start:self._words_start + end]
+
+    def __iter__(self):
+        """
+        Iterate over words in sorted order
+        """
+        for ind in range(self._count):
+            yield self[ind]
+
+    def __contains__(self, word):
+        """
+        Binary search for word, narrowed by the first letter index
+        when the cache has one
+        """
+        low, high = 0, self._count
+        if self._index_start != None and word:
+            code = ord(word[0])
+            low = self._unpack(self._buffer, self._index_start + 4 * code)[0]
+            high = self._unpack(self._buffer, self._index_start + 4 * code + 4)[0]
+        while low < high:
+            middle = (low + high) // 2
+            if self[middle] < word:
+                low = middle + 1
+            else:
+                high = middle
+        return low < self._count and self[low] == word
+
+def load_words_cached(source_path, cache_path = None, with_index = True):
+    """
+    Load word list from the local file source_path through a compiled
+    cache, cache_path defaults to source_path + CACHE_SUFFIX.
+
+    The cache is rebuilt when it is missing, unreadable or older than
+    the source file. Returns a MappedWordList.
+    """
+    import os
+    if cache_path == None:
+        cache_path = source_path + CACHE_SUFFIX
+    if os.path.exists(cache_path):
+        try:
+            words = MappedWordList(cache_path)
+        except ValueError:
+            words = None
+        if words != None:
+            if words.matches_source(source_path):
+                return words
+            words.close()
+    compile_words(source_path, cache_path, with_index)
+    return MappedWordList(cache_path)
+
+# Bulk rack solving over a process pool
+
+# per process trie of the dictionary, shared copy-on-write with
+# forked workers
+_RACK_TRIE = None
+
+def _init_rack_worker(cache_path):
+    """
+    Pool initializer, builds the trie from the compiled cache only
+    when it was not inherited from the parent process
+    """
+    global _RACK_TRIE
+    if _RACK_TRIE == None:
+        _RACK_TRIE = WordTrie(MappedWordList(cache_path))
+
+def _solve_rack(task):
+    """
+    Solve one rack in a worker process
+    task: (index, rack, min_length)
+    Returns dictionary with index, rack, words and count
+    """
+    index, rack, min_length = task
+    words = list(_RACK_TRIE.words_from(rack, min_length))
+    return {"index": index, "rack": rack, "words": words, "count": len(words)}
+
+def solve_racks(racks, word_path, processes = None, min_length = 1, chunksize = 16):
+    """
+    Generator that finds the dictionary words of every rack in the
+    iterable racks across a process pool.
+
+    The dictionary word_path is compiled with load_words_cached and
+    loaded into one WordTrie before the workers start, so forked
+    workers share it instead of loading their own copy.
+    Yields result dictionaries, see _solve_rack, as racks finish.
+    """
+    global _RACK_TRIE
+    import multiprocessing
+    words = load_words_cached(word_path)
+    cache_path = word_path + CACHE_SUFFIX
+    _RACK_TRIE = WordTrie(words)
+    words.close()
+    tasks = ((index, rack, min_length) for index, rack in enumerate(racks))
+    pool = multiprocessing.Pool(processes, _init_rack_worker, (cache_path,))
+    try:
+        for result in pool.imap_unordered(_solve_rack, tasks, chunksize):
+            yield result
+    finally:
+        pool.terminate()
+
+def main(argv):
+    """
+    Command line entry point, reads racks one per line and writes
+    one JSON line with the words of each rack as it is solved,
+    racks per second are reported on stderr
+    """
+    import argparse
+    import json
+    parser = argparse.ArgumentParser(description = "Solve Word Wrangler racks in bulk")
+    parser.add_argument("words", help = "local word file, one word per line")
+    parser.add_argument("racks", nargs = "?", default = "-",
+                        help = "file with one rack per line, - for stdin")
+    parser.add_argument("--processes", type = int, default = None,
+                        help = "worker processes, defaults to cpu count")
+    parser.add_argument("--min-length", type = int, default = 1)
+    parser.add_argument("--chunksize", type = int, default = 16)
+    args = parser.parse_args(argv)
+    if args.racks == "-":
+        racks = (line.strip() for line in sys.stdin)
+    else:
+        racks = iter_word_file(args.racks)
+    num_racks = 0
+    start = time.time()
+    for result in solve_racks(racks, args.words, args.processes,
+                              args.min_length, args.chunksize):
+        sys.stdout.write(json.dumps(result) + "\n")
+        num_racks += 1
+    elapsed = time.time() - start
+    sys.stdout.flush()
+    sys.stderr.write("racks=%d seconds=%.3f racks/s=%.2f\n"
+                     % (num_racks, elapsed, num_racks / elapsed if elapsed > 0 else 0.0))
+
 def run():
     """
     Run game.
@@ -119,6 +707,9 @@ def run():
                                      gen_all_strings)
     provided.run_game(wrangler)
 
+if __name__ == "__main__":
+    main(sys.argv[1:])
+
 # Uncomment when you are ready to try the game
 #run()
 
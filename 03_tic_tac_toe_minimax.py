@@ -2,6 +2,7 @@
 Mini-max Tic-Tac-Toe Player
 """
 
+import time
 import poc_ttt_gui
 import poc_ttt_provided as provided
 #import user39_CjYkfB57FI_15 as provided
@@ -15,6 +16,138 @@ SCORES = {provided.PLAYERX: 1,
           provided.DRAW: 0,
           provided.PLAYERO: -1}
 
+# Transposition table shared by all mm_move calls in a session:
+# (reverse, player, canonical board) -> (score, canonical move index
+# or -1), reverse is True for boards of the reverse game, see _is_reverse
+_TABLE = {}
+_TABLE_STATS = {"hits": 0, "misses": 0}
+# dim -> for each of the 8 board symmetries, the original square
+# index of every square index of the transformed board
+_SYMMETRIES = {}
+# searched positions per search strategy, see node_counts
+_NODE_COUNTS = {"minimax": 0, "alphabeta": 0, "bitboard": 0, "iterative": 0}
+# (dim, win_length) -> list of winning lines as tuples of square indices
+_WIN_LINES = {}
+# transposition table entry kinds in alpha-beta search
+EXACT, LOWER, UPPER = 0, 1, 2
+# (dim, win_length) -> (win masks through each square, full board mask,
+# squares in search order) for bitboard search
+_BITBOARD_MASKS = {}
+# bitboard search table shared by a session:
+# (dim, win_length, mover bits, opponent bits) -> (value, kind, square)
+_BB_TABLE = {}
+BB_TABLE_SIZE = 2000000
+# opening book of perfect play for the 3x3 game, one byte per
+# (board code, player to move): NO_BOOK_ENTRY or
+# (score + 1) * 16 + row * 3 + col
+BOOK_FILE = "ttt_opening_book.bin"
+BOOK_DIM = 3
+NO_BOOK_ENTRY = 0xFF
+_BOOK_DIGITS = {provided.EMPTY: 0, provided.PLAYERX: 1, provided.PLAYERO: 2}
+_BOOK = None
+# (dim, win_length) -> bitmask of every winning line
+_LINE_MASKS = {}
+# time per move of id_move_wrapper in seconds
+ID_BUDGET = 1.0
+# best root value found so far by parallel_move workers, shared
+# between processes
+_SPLIT_BOUND = None
+
+def _symmetry_sources(dim):
+    """
+    Return for every rotation and reflection of a dim x dim board
+    the list mapping transformed square index to original index
+    """
+    if dim not in _SYMMETRIES:
+        last = dim - 1
+        transforms = [lambda row, col: (row, col),
+                      lambda row, col: (col, last - row),
+                      lambda row, col: (last - row, last - col),
+                      lambda row, col: (last - col, row),
+                      lambda row, col: (row, last - col),
+                      lambda row, col: (last - row, col),
+                      lambda row, col: (col, row),
+                      lambda row, col: (last - col, last - row)]
+        symmetries = []
+        for transform in transforms:
+            sources = [0] * (dim * dim)
+            for row in range(dim):
+                for col in range(dim):
+                    new_row, new_col = transform(row, col)
+                    sources[new_row * dim + new_col] = row * dim + col
+            symmetries.append(sources)
+        _SYMMETRIES[dim] = symmetries
+    return _SYMMETRIES[dim]
+
+def _canonical(board, player, reverse):
+    """
+    Return (key, sources): key is the smallest encoding of board over
+    its 8 symmetries together with reverse and player, sources maps
+    square indices of the canonical board to the original board
+    """
+    dim = board.get_dim()
+    cells = [board.square(row, col) for row in range(dim) for col in range(dim)]
+    best_key, best_sources = None, None
+    for sources in _symmetry_sources(dim):
+        key = tuple([cells[src] for src in sources])
+        if best_key == None or key < best_key:
+            best_key, best_sources = key, sources
+    return (reverse, player, best_key), best_sources
+
+def _is_reverse(board):
+    """
+    Check whether board plays the reverse game, where completing a
+    line loses. A completed line, or one completed on a clone, is
+    compared with the winner check_win reports. Boards where no line
+    can be completed any more are scored the same in both games and
+    count as standard.
+    """
+    dim = board.get_dim()
+    cells = [board.square(row, col) for row in range(dim) for col in range(dim)]
+    for line in win_lines(dim, dim):
+        marks = set([cells[square] for square in line])
+        if len(marks) == 1 and provided.EMPTY not in marks:
+            return board.check_win() != cells[line[0]]
+    for line in win_lines(dim, dim):
+        for mark in (provided.PLAYERX, provided.PLAYERO):
+            if set([cells[square] for square in line]) <= set([provided.EMPTY, mark]):
+                clone = board.clone()
+                for square in line:
+                    clone.move(square // dim, square % dim, mark)
+                return clone.check_win() != mark
+    return False
+
+def transposition_stats():
+    """
+    Return dictionary with hits, misses, hit rate and number of
+    entries of the mm_move transposition table
+    """
+    lookups = _TABLE_STATS["hits"] + _TABLE_STATS["misses"]
+    return {"hits": _TABLE_STATS["hits"], "misses": _TABLE_STATS["misses"],
+            "hit_rate": float(_TABLE_STATS["hits"]) / lookups if lookups else 0.0,
+            "entries": len(_TABLE)}
+
+def node_counts():
+    """
+    Return dictionary of positions searched so far by each strategy
+    """
+    return dict(_NODE_COUNTS)
+
+def reset_node_counts():
+    """
+    Reset searched position counters
+    """
+    for strategy in _NODE_COUNTS:
+        _NODE_COUNTS[strategy] = 0
+
+def clear_transposition_table():
+    """
+    Empty the mm_move transposition table and reset its counters
+    """
+    _TABLE.clear()
+    _TABLE_STATS["hits"] = 0
+    _TABLE_STATS["misses"] = 0
+
 #def conv_player(player):
 #    """
 #    Takes a player in poc_ttt_provided form and returns a player
@@ -30,7 +163,40 @@ def mm_move(board, player):
     Returns a tuple with two elements.  The first element is the score
     of the given board and the second element is the desired move as a
     tuple, (row, col).
+
+    Positions are remembered in a transposition table keyed on the
+    canonical board, so positions equal up to rotation or reflection
+    are searched once per session. Boards of the reverse game are
+    kept apart from standard ones.
     """
+    return _mm_lookup(board, player, _is_reverse(board))
+
+def _mm_lookup(board, player, reverse):
+    """
+    Transposition table lookup for mm_move, reverse tells whether
+    board plays the reverse game
+    """
+    key, sources = _canonical(board, player, reverse)
+    if key in _TABLE:
+        _TABLE_STATS["hits"] += 1
+        score, index = _TABLE[key]
+        if index == -1:
+            return score, (-1, -1)
+        return score, divmod(sources[index], board.get_dim())
+    _TABLE_STATS["misses"] += 1
+    score, move = _mm_search(board, player, reverse)
+    if move == (-1, -1):
+        _TABLE[key] = (score, -1)
+    else:
+        _TABLE[key] = (score, sources.index(move[0] * board.get_dim() + move[1]))
+    return score, move
+
+def _mm_search(board, player, reverse):
+    """
+    Minimax search of board without the table lookup, children are
+    evaluated with _mm_lookup.
+    """
+    _NODE_COUNTS["minimax"] += 1
     winner = board.check_win()
     if winner == None: # game still in progress
         moves, scores = [], []
@@ -38,7 +204,7 @@ def mm_move(board, player):
         for square in squares:
             brd = board.clone()
             brd.move(square[0], square[1], player)
-            result = mm_move(brd, provided.switch_player(player))
+            result = _mm_lookup(brd, provided.switch_player(player), reverse)
             if result[0] * SCORES[player] == 1: # found a winning move
                 return result[0], square
             scores.append(result[0])
@@ -51,18 +217,656 @@ def mm_move(board, player):
     else: # game over
         return SCORES[winner], (-1, -1)
 
+def win_lines(dim, win_length):
+    """
+    Return list of all winning lines of win_length squares in a row,
+    column or diagonal of a dim x dim board, as tuples of square
+    indices row * dim + col
+    """
+    if (dim, win_length) not in _WIN_LINES:
+        lines = []
+        for row in range(dim):
+            for col in range(dim):
+                for drow, dcol in ((0, 1), (1, 0), (1, 1), (1, -1)):
+                    end_row = row + drow * (win_length - 1)
+                    end_col = col + dcol * (win_length - 1)
+                    if 0 <= end_row < dim and 0 <= end_col < dim:
+                        lines.append(tuple((row + drow * step) * dim + col + dcol * step
+                                           for step in range(win_length)))
+        _WIN_LINES[(dim, win_length)] = lines
+    return _WIN_LINES[(dim, win_length)]
+
+class AlphaBeta:
+    """
+    Alpha-beta search for Tic-Tac-Toe on a dim x dim board won with
+    win_length in a row, scores follow the SCORES convention
+    """
+
+    def __init__(self, dim, win_length = None, max_table_size = 2000000):
+        """
+        Prepare winning lines and move ordering for the board size
+        max_table_size bounds the transposition table of one search
+        """
+        self._dim = dim
+        self._win_length = win_length if win_length != None else dim
+        self._lines = win_lines(dim, self._win_length)
+        self._lines_of = [[] for dummy_square in range(dim * dim)]
+        for line_ind in range(len(self._lines)):
+            for square in self._lines[line_ind]:
+                self._lines_of[square].append(line_ind)
+        self._max_table_size = max_table_size
+        self._nodes = 0
+
+    def get_nodes(self):
+        """
+        Return number of positions searched by the last search
+        """
+        return self._nodes
+
+    def search(self, board, player):
+        """
+        Search board with player to move
+        Returns (score, (row, col)) like mm_move, the move is (-1, -1)
+        when the game is over
+        """
+        dim = self._dim
+        self._cells = [board.square(row, col) for row in range(dim) for col in range(dim)]
+        self._counts = {provided.PLAYERX: [0] * len(self._lines),
+                        provided.PLAYERO: [0] * len(self._lines)}
+        self._dead_lines = 0
+        self._table = {}
+        self._nodes = 0
+        winner = None
+        for square in range(dim * dim):
+            if self._cells[square] != provided.EMPTY:
+                if self._make(square, self._cells[square]):
+                    winner = self._cells[square]
+        empties = [square for square in range(dim * dim)
+                   if self._cells[square] == provided.EMPTY]
+        if winner != None:
+            return SCORES[winner], (-1, -1)
+        if len(empties) == 0 or self._dead_lines == len(self._lines):
+            if len(empties) == 0:
+                return SCORES[provided.DRAW], (-1, -1)
+            return SCORES[provided.DRAW], divmod(empties[0], dim)
+        score, square = self._search(player, -2, 2, empties)
+        _NODE_COUNTS["alphabeta"] += self._nodes
+        self._table = {}
+        return score, divmod(square, dim)
+
+    def _make(self, square, player):
+        """
+        Put player's mark on square, returns True if it wins
+        """
+        self._cells[square] = player
+        own = self._counts[player]
+        other = self._counts[provided.switch_player(player)]
+        won = False
+        for line_ind in self._lines_of[square]:
+            own[line_ind] += 1
+            if own[line_ind] == 1 and other[line_ind] > 0:
+                self._dead_lines += 1
+            if own[line_ind] == self._win_length:
+                won = True
+        return won
+
+    def _unmake(self, square, player):
+        """
+        Remove player's mark from square
+        """
+        self._cells[square] = provided.EMPTY
+        own = self._counts[player]
+        other = self._counts[provided.switch_player(player)]
+        for line_ind in self._lines_of[square]:
+            if own[line_ind] == 1 and other[line_ind] > 0:
+                self._dead_lines -= 1
+            own[line_ind] -= 1
+
+    def _move_priority(self, square, own, other):
+        """
+        Heuristic value of a move: wins first, then blocks, then
+        squares on many lines that are still open
+        """
+        value = 0
+        for line_ind in self._lines_of[square]:
+            if other[line_ind] == 0:
+                if own[line_ind] == self._win_length - 1:
+                    return 1000000
+                value += (own[line_ind] + 1) ** 2
+            if own[line_ind] == 0:
+                if other[line_ind] == self._win_length - 1:
+                    value += 10000
+                value += other[line_ind] ** 2
+        return value
+
+    def _search(self, player, alpha, beta, empties):
+        """
+        Alpha-beta search of the current position
+        Returns (score, square)
+        """
+        self._nodes += 1
+        key = (tuple(self._cells), player)
+        entry = self._table.get(key)
+        if entry != None:
+            value, kind, square = entry
+            if kind == EXACT:
+                return value, square
+            elif kind == LOWER:
+                alpha = max(alpha, value)
+            else:
+                beta = min(beta, value)
+            if alpha >= beta:
+                return value, square
+        alpha_orig, beta_orig = alpha, beta
+        opponent = provided.switch_player(player)
+        own, other = self._counts[player], self._counts[opponent]
+        moves = sorted(empties, key = lambda square: -self._move_priority(square, own, other))
+        maximizing = SCORES[player] > 0
+        best_value, best_square = (-2 if maximizing else 2), moves[0]
+        for square in moves:
+            if self._make(square, player):
+                value = SCORES[player]
+            elif len(empties) == 1 or self._dead_lines == len(self._lines):
+                value = SCORES[provided.DRAW]
+            else:
+                value = self._search(opponent, alpha, beta,
+                                     [empty for empty in empties if empty != square])[0]
+            self._unmake(square, player)
+            if maximizing and value > best_value or not maximizing and value < best_value:
+                best_value, best_square = value, square
+            if maximizing:
+                alpha = max(alpha, value)
+            else:
+                beta = min(beta, value)
+            if alpha >= beta:
+                break
+        if len(self._table) < self._max_table_size:
+            if best_value <= alpha_orig:
+                kind = UPPER
+            elif best_value >= beta_orig:
+                kind = LOWER
+            else:
+                kind = EXACT
+            self._table[key] = (best_value, kind, best_square)
+        return best_value, best_square
+
+def ab_move(board, player, win_length = None):
+    """
+    Make a move on the board with alpha-beta search, win_length in a
+    row wins and defaults to the board size.
+
+    Returns a tuple (score, (row, col)) like mm_move.
+    Standard games only, use mm_move for reverse boards.
+    """
+    return AlphaBeta(board.get_dim(), win_length).search(board, player)
+
+def line_masks(dim, win_length):
+    """
+    Return list with the bitmask of every winning line
+    """
+    if (dim, win_length) not in _LINE_MASKS:
+        masks = []
+        for line in win_lines(dim, win_length):
+            mask = 0
+            for square in line:
+                mask |= 1 << square
+            masks.append(mask)
+        _LINE_MASKS[(dim, win_length)] = masks
+    return _LINE_MASKS[(dim, win_length)]
+
+def _bitboard_masks(dim, win_length):
+    """
+    Return (masks_through, full, order) for bitboard search:
+    masks_through[square] lists the bitmasks of winning lines through
+    square, full has all squares set and order lists squares with
+    the most winning lines first
+    """
+    if (dim, win_length) not in _BITBOARD_MASKS:
+        masks_through = [[] for dummy_square in range(dim * dim)]
+        for line, mask in zip(win_lines(dim, win_length), line_masks(dim, win_length)):
+            for square in line:
+                masks_through[square].append(mask)
+        order = sorted(range(dim * dim), key = lambda square: -len(masks_through[square]))
+        _BITBOARD_MASKS[(dim, win_length)] = (masks_through, (1 << (dim * dim)) - 1, order)
+    return _BITBOARD_MASKS[(dim, win_length)]
+
+def board_to_bits(board):
+    """
+    Return (x_bits, o_bits), bit row * dim + col is set in x_bits or
+    o_bits when PLAYERX or PLAYERO holds that square
+    """
+    dim = board.get_dim()
+    x_bits, o_bits = 0, 0
+    for row in range(dim):
+        for col in range(dim):
+            if board.square(row, col) == provided.PLAYERX:
+                x_bits |= 1 << (row * dim + col)
+            elif board.square(row, col) == provided.PLAYERO:
+                o_bits |= 1 << (row * dim + col)
+    return x_bits, o_bits
+
+def _bb_terminal(x_bits, o_bits, dim, win_length):
+    """
+    Return SCORES value of the finished game on the bitboards,
+    None while the game goes on
+    """
+    for mask in line_masks(dim, win_length):
+        if (x_bits & mask) == mask:
+            return SCORES[provided.PLAYERX]
+        if (o_bits & mask) == mask:
+            return SCORES[provided.PLAYERO]
+    if (x_bits | o_bits) == (1 << (dim * dim)) - 1:
+        return SCORES[provided.DRAW]
+    return None
+
+def _bb_negamax(own, other, masks, alpha, beta, table_key, root = False):
+    """
+    Negamax alpha-beta search on bitboards, own holds the squares of
+    the player to move
+    Returns (value for the player to move, square)
+    At the root only exact table entries are used, narrowing the
+    window there could leave a move that only bounds the value
+    """
+    _NODE_COUNTS["bitboard"] += 1
+    masks_through, full, order = masks
+    key = table_key + (own, other)
+    entry = _BB_TABLE.get(key)
+    if entry != None and (not root or entry[1] == EXACT):
+        value, kind, square = entry
+        if kind == EXACT:
+            return value, square
+        elif kind == LOWER:
+            alpha = max(alpha, value)
+        else:
+            beta = min(beta, value)
+        if alpha >= beta:
+            return value, square
+    alpha_orig = alpha
+    taken = own | other
+    best_value, best_square = -2, -1
+    for square in order:
+        bit = 1 << square
+        if taken & bit:
+            continue
+        mine = own | bit
+        value = None
+        for mask in masks_through[square]:
+            if (mine & mask) == mask:
+                value = 1
+                break
+        if value == None:
+            if (taken | bit) == full:
+                value = 0
+            else:
+                value = -_bb_negamax(other, mine, masks, -beta, -alpha, table_key)[0]
+        if value > best_value:
+            best_value, best_square = value, square
+        alpha = max(alpha, value)
+        if alpha >= beta:
+            break
+    if len(_BB_TABLE) >= BB_TABLE_SIZE:
+        _BB_TABLE.clear()
+    if best_value <= alpha_orig:
+        kind = UPPER
+    elif best_value >= beta:
+        kind = LOWER
+    else:
+        kind = EXACT
+    _BB_TABLE[key] = (best_value, kind, best_square)
+    return best_value, best_square
+
+def bb_move(board, player, win_length = None):
+    """
+    Make a move on the board with bitboard alpha-beta search,
+    win_length in a row wins and defaults to the board size.
+
+    Takes a provided board and returns (score, (row, col)) like
+    mm_move, the board itself is not modified. Standard games only,
+    use mm_move for reverse boards.
+    """
+    dim = board.get_dim()
+    if win_length == None:
+        win_length = dim
+    masks = _bitboard_masks(dim, win_length)
+    x_bits, o_bits = board_to_bits(board)
+    score = _bb_terminal(x_bits, o_bits, dim, win_length)
+    if score != None:
+        return score, (-1, -1)
+    if player == provided.PLAYERX:
+        own, other = x_bits, o_bits
+    else:
+        own, other = o_bits, x_bits
+    value, square = _bb_negamax(own, other, masks, -2, 2, (dim, win_length), True)
+    return value * SCORES[player], divmod(square, dim)
+
+class _SearchTimeout(Exception):
+    """
+    Raised inside iterative deepening when the deadline has passed
+    """
+    pass
+
+def line_evaluation(own, other, lines):
+    """
+    Default position evaluation for iterative deepening: open lines
+    weighted by the square of the marks on them, own lines count for
+    and other lines against the player to move.
+
+    Evaluations take the bits of the player to move, of the opponent
+    and the winning line masks and must stay strictly between -1 and 1
+    so that they never look like a decided game.
+    """
+    value = 0
+    for mask in lines:
+        if not other & mask:
+            value += bin(own & mask).count("1") ** 2
+        elif not own & mask:
+            value -= bin(other & mask).count("1") ** 2
+    return float(value) / (len(lines) * bin(lines[0]).count("1") ** 2 + 1)
+
+def _depth_negamax(own, other, masks, lines, depth, alpha, beta, evaluate, deadline):
+    """
+    Depth limited negamax alpha-beta search on bitboards, positions at
+    depth 0 are scored with evaluate
+    Returns (value for the player to move, square)
+    """
+    _NODE_COUNTS["iterative"] += 1
+    if time.time() > deadline:
+        raise _SearchTimeout()
+    if depth == 0:
+        return evaluate(own, other, lines), -1
+    masks_through, full, order = masks
+    taken = own | other
+    best_value, best_square = -2, -1
+    for square in order:
+        bit = 1 << square
+        if taken & bit:
+            continue
+        mine = own | bit
+        value = None
+        for mask in masks_through[square]:
+            if (mine & mask) == mask:
+                value = 1
+                break
+        if value == None:
+            if (taken | bit) == full:
+                value = 0
+            else:
+                value = -_depth_negamax(other, mine, masks, lines, depth - 1,
+                                        -beta, -alpha, evaluate, deadline)[0]
+        if value > best_value:
+            best_value, best_square = value, square
+        alpha = max(alpha, value)
+        if alpha >= beta:
+            break
+    return best_value, best_square
+
+def _id_root(own, other, masks, lines, depth, root_moves, evaluate, deadline):
+    """
+    Search the root moves in the given order to depth
+    Returns (value, square, complete) for the best root move searched
+    before the deadline passed, square is None when there was none
+    """
+    masks_through, full, dummy_order = masks
+    taken = own | other
+    best_value, best_square = -2, None
+    for square in root_moves:
+        bit = 1 << square
+        mine = own | bit
+        value = None
+        for mask in masks_through[square]:
+            if (mine & mask) == mask:
+                value = 1
+                break
+        if value == None:
+            if (taken | bit) == full:
+                value = 0
+            else:
+                try:
+                    value = -_depth_negamax(other, mine, masks, lines, depth - 1,
+                                            -2, -best_value, evaluate, deadline)[0]
+                except _SearchTimeout:
+                    return best_value, best_square, False
+        if value > best_value:
+            best_value, best_square = value, square
+        if best_value == 1:
+            break
+    return best_value, best_square, True
+
+def id_move(board, player, deadline, evaluate = line_evaluation, win_length = None):
+    """
+    Make a move on the board with iterative deepening: search to depth
+    1, 2 and so on until the game is solved or time.time() passes
+    deadline. Positions at the depth limit are scored with evaluate,
+    see line_evaluation.
+
+    Returns (score, (row, col), depth) where depth is the deepest
+    completed search. The score follows the SCORES convention and is
+    exact when it is -1, 0 or 1. When the deadline passes before
+    depth 1 completes, depth is 0 and the move is the best root move
+    searched so far, or the first legal move with score 0.
+    Standard games only, use mm_move for reverse boards.
+    """
+    dim = board.get_dim()
+    if win_length == None:
+        win_length = dim
+    masks = _bitboard_masks(dim, win_length)
+    order = masks[2]
+    lines = line_masks(dim, win_length)
+    x_bits, o_bits = board_to_bits(board)
+    score = _bb_terminal(x_bits, o_bits, dim, win_length)
+    if score != None:
+        return score, (-1, -1), 0
+    if player == provided.PLAYERX:
+        own, other = x_bits, o_bits
+    else:
+        own, other = o_bits, x_bits
+    root_moves = [square for square in order if not (own | other) & (1 << square)]
+    best_value, best_square, depth = 0, root_moves[0], 0
+    while depth < len(root_moves) and abs(best_value) != 1:
+        value, square, complete = _id_root(own, other, masks, lines, depth + 1,
+                                           root_moves, evaluate, deadline)
+        if not complete:
+            # part of a depth 1 search still beats an unsearched move
+            if depth == 0 and square != None:
+                best_value, best_square = value, square
+            break
+        best_value, best_square = value, square
+        depth += 1
+        # search the previous best move first, deeper plies keep their order
+        root_moves = [best_square] + [move for move in root_moves if move != best_square]
+    return best_value * SCORES[player], divmod(best_square, dim), depth
+
+def _init_split_worker(bound):
+    """
+    Pool initializer, keeps the shared root bound of parallel_move
+    """
+    global _SPLIT_BOUND
+    _SPLIT_BOUND = bound
+
+def _search_split(task):
+    """
+    Search one root move, or one root move and one reply, in a worker
+    task: (root player bits, opponent bits, dim, win_length, squares)
+    Returns (squares, value for the root player, exact), a value
+    that is not exact is only an upper bound of a move that cannot
+    beat the shared bound
+    """
+    own, other, dim, win_length, squares = task
+    masks = _bitboard_masks(dim, win_length)
+    masks_through, full, dummy_order = masks
+    sign = 1
+    for square in squares:
+        mine = own | (1 << square)
+        for mask in masks_through[square]:
+            if (mine & mask) == mask:
+                return squares, sign, True
+        if (mine | other) == full:
+            return squares, 0, True
+        own, other = other, mine
+        sign = -sign
+    if sign == 1:
+        return squares, _bb_negamax(own, other, masks, -2, 2, (dim, win_length))[0], True
+    alpha = _SPLIT_BOUND.value
+    if alpha == 1:
+        return squares, 1, False
+    value = -_bb_negamax(own, other, masks, -2, -alpha, (dim, win_length))[0]
+    with _SPLIT_BOUND.get_lock():
+        if value > _SPLIT_BOUND.value:
+            _SPLIT_BOUND.value = value
+    return squares, value, value > alpha
+
+def parallel_move(board, player, processes = None, split_depth = 1, win_length = None):
+    """
+    Make a move on the board with bitboard alpha-beta search split
+    across a process pool: every root move, or every root move and
+    reply when split_depth is 2, is searched by a worker.
+
+    Root move workers share the best value found so far as their
+    alpha bound, each worker keeps its bitboard table across the
+    moves it searches. Returns (score, (row, col)) like mm_move.
+    Standard games only, use mm_move for reverse boards.
+    """
+    import multiprocessing
+    dim = board.get_dim()
+    if win_length == None:
+        win_length = dim
+    x_bits, o_bits = board_to_bits(board)
+    score = _bb_terminal(x_bits, o_bits, dim, win_length)
+    if score != None:
+        return score, (-1, -1)
+    masks_through, dummy_full, order = _bitboard_masks(dim, win_length)
+    if player == provided.PLAYERX:
+        own, other = x_bits, o_bits
+    else:
+        own, other = o_bits, x_bits
+    empties = [square for square in order if not (own | other) & (1 << square)]
+    tasks = []
+    for first in empties:
+        replies = [square for square in empties if square != first]
+        mine = own | (1 << first)
+        wins = len([mask for mask in masks_through[first] if (mine & mask) == mask]) > 0
+        if split_depth < 2 or wins or len(replies) == 0:
+            tasks.append((own, other, dim, win_length, (first,)))
+        else:
+            tasks.extend((own, other, dim, win_length, (first, reply)) for reply in replies)
+    bound = multiprocessing.Value("b", -2)
+    pool = multiprocessing.Pool(processes, _init_split_worker, (bound,))
+    try:
+        results = pool.map(_search_split, tasks, 1)
+    finally:
+        pool.terminate()
+    values = {}
+    for squares, value, exact in results:
+        if exact:
+            # a root move is worth its worst reply
+            values[squares[0]] = min(value, values.get(squares[0], value))
+    best_square = max(empties, key = lambda square: values.get(square, -2))
+    return values[best_square] * SCORES[player], divmod(best_square, dim)
+
+def _book_index(board, player):
+    """
+    Return index of board and player to move in the opening book,
+    the board is read as a base 3 number
+    """
+    code = 0
+    for row in range(BOOK_DIM - 1, -1, -1):
+        for col in range(BOOK_DIM - 1, -1, -1):
+            code = code * 3 + _BOOK_DIGITS[board.square(row, col)]
+    return code * 2 + (0 if player == provided.PLAYERX else 1)
+
+def build_opening_book(path = BOOK_FILE):
+    """
+    Solve every position reachable from the empty 3x3 board, with
+    either player moving first, and write the best move and score of
+    each to path. Returns the number of positions in the book.
+    """
+    book = bytearray([NO_BOOK_ENTRY]) * (3 ** (BOOK_DIM * BOOK_DIM) * 2)
+    stack = [(provided.TTTBoard(BOOK_DIM), provided.PLAYERX),
+             (provided.TTTBoard(BOOK_DIM), provided.PLAYERO)]
+    num_positions = 0
+    while len(stack) != 0:
+        board, player = stack.pop()
+        index = _book_index(board, player)
+        if book[index] != NO_BOOK_ENTRY or board.check_win() != None:
+            continue
+        score, move = bb_move(board, player)
+        book[index] = (score + 1) * 16 + move[0] * BOOK_DIM + move[1]
+        num_positions += 1
+        for square in board.get_empty_squares():
+            child = board.clone()
+            child.move(square[0], square[1], player)
+            stack.append((child, provided.switch_player(player)))
+    with open(path, "wb") as book_file:
+        book_file.write(book)
+    return num_positions
+
+def load_opening_book(path = BOOK_FILE):
+    """
+    Load opening book written by build_opening_book, returns False
+    when there is no book at path
+    """
+    global _BOOK
+    try:
+        with open(path, "rb") as book_file:
+            _BOOK = bytearray(book_file.read())
+    except IOError:
+        _BOOK = None
+    return _BOOK != None
+
+def book_move(board, player):
+    """
+    Look the position up in the opening book.
+
+    Returns (score, (row, col)) like mm_move, or None when no book
+    is loaded or the position is not in it. The book holds standard
+    games only, use mm_move for reverse boards.
+    """
+    if _BOOK == None or board.get_dim() != BOOK_DIM:
+        return None
+    entry = _BOOK[_book_index(board, player)]
+    if entry == NO_BOOK_ENTRY:
+        return None
+    return entry // 16 - 1, divmod(entry % 16, BOOK_DIM)
+
 def move_wrapper(board, player, trials):
     """
     Wrapper to allow the use of the same infrastructure that was used
-    for Monte Carlo Tic-Tac-Toe.
+    for Monte Carlo Tic-Tac-Toe. Reverse boards are searched with
+    mm_move, the opening book and bitboard search assume standard games.
     """
     print "Initial board:\n", board
     print "Player", ("X" if player == provided.PLAYERX else "O"), "moves first"
     print
-    move = mm_move(board, player)
+    if _is_reverse(board):
+        move = mm_move(board, player)
+    else:
+        move = book_move(board, player)
+        if move == None:
+            move = bb_move(board, player)
+    assert move[1] != (-1, -1), "returned illegal move (-1, -1)"
+    return move[1]
+
+def ab_move_wrapper(board, player, trials):
+    """
+    Same as move_wrapper, but uses alpha-beta search so that boards
+    larger than 3x3 can be played. Standard games only.
+    """
+    move = ab_move(board, player)
     assert move[1] != (-1, -1), "returned illegal move (-1, -1)"
     return move[1]
 
+def id_move_wrapper(board, player, trials):
+    """
+    Same as move_wrapper, but uses iterative deepening with ID_BUDGET
+    seconds per move so that large boards answer in time. Standard
+    games only.
+    """
+    move = id_move(board, player, time.time() + ID_BUDGET)
+    assert move[1] != (-1, -1), "returned illegal move (-1, -1)"
+    return move[1]
+
+load_opening_book()
+
 # Test game with the console or the GUI.
 # Uncomment whichever you prefer.
 # Both should be commented out when you submit for
@@ -70,3 +874,8 @@ def move_wrapper(board, player, trials):
 
 #provided.play_game(move_wrapper, 1, False)        
 #poc_ttt_gui.run_gui(3, provided.PLAYERO, move_wrapper, 1, False)
+#poc_ttt_gui.run_gui(4, provided.PLAYERO, ab_move_wrapper, 1, False)
+#poc_ttt_gui.run_gui(5, provided.PLAYERO, id_move_wrapper, 1, False)
+
+# Build the opening book once, it is loaded on the next start
+#build_opening_book()
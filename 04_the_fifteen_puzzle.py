@@ -4,8 +4,229 @@ Note that solved configuration has the blank (zero) tile in upper left
 Use the arrows key to swap this tile with its neighbors
 """
 
+import copy
+import time
+from array import array
 import poc_fifteen_gui
 
+# (height, width) -> direction -> flat index of the neighbor of every
+# flat index, -1 off the grid. Lists rather than arrays, indexing
+# them is faster in the move loop
+_NEIGHBORS = {}
+
+def _neighbor_tables(height, width):
+    """
+    Return neighbor tables for a puzzle of the given size,
+    see _NEIGHBORS
+    """
+    if (height, width) not in _NEIGHBORS:
+        size = height * width
+        _NEIGHBORS[(height, width)] = {
+            "l": [-1 if index % width == 0 else index - 1
+                  for index in range(size)],
+            "r": [-1 if index % width == width - 1 else index + 1
+                  for index in range(size)],
+            "u": [index - width if index >= width else -1
+                  for index in range(size)],
+            "d": [index + width if index < size - width else -1
+                  for index in range(size)]}
+    return _NEIGHBORS[(height, width)]
+
+# check the incremental solved records against full grid scans
+# in every invariant and in _is_solved, slow
+DEBUG_SCANS = False
+
+# optimal solving is limited to boards with at most this many rows
+# and columns, linear conflict tables grow as (side + 1) ** side
+OPTIMAL_MAX_SIDE = 4
+INVERSE_MOVES = {"l": "r", "r": "l", "u": "d", "d": "u", None: None}
+# line length -> linear conflict cost, 2 moves per tile that has to
+# leave the line, of every line code, see OptimalSolver
+_CONFLICT_TABLES = {}
+
+def _conflict_table(length):
+    """
+    Return linear conflict costs of all line codes for lines of the
+    given length. A line code has one base length + 1 digit per cell,
+    0 for a cell without a tile solved in this line, else the solved
+    position of the tile in the line plus one.
+    """
+    if length not in _CONFLICT_TABLES:
+        base = length + 1
+        table = []
+        for code in range(base ** length):
+            digits = []
+            for dummy_cell in range(length):
+                digits.append(code % base)
+                code //= base
+            goals = [digit for digit in reversed(digits) if digit != 0]
+            # tiles that stay form the longest increasing subsequence
+            longest = [1] * len(goals)
+            for pos in range(len(goals)):
+                for before in range(pos):
+                    if goals[before] < goals[pos]:
+                        longest[pos] = max(longest[pos], longest[before] + 1)
+            table.append(2 * (len(goals) - max(longest + [0])))
+        _CONFLICT_TABLES[length] = table
+    return _CONFLICT_TABLES[length]
+
+class OptimalSolver:
+    """
+    IDA* search for a shortest solution of a puzzle of at most
+    OPTIMAL_MAX_SIDE rows and columns, using Manhattan distance plus linear
+    conflicts as heuristic. The heuristic is updated incrementally
+    on every move and the search works on one flat board and one
+    path buffer, so no memory is allocated per node.
+    """
+
+    def __init__(self, puzzle):
+        """
+        Copy the position of puzzle and precompute heuristic tables
+        """
+        height, width = puzzle.get_height(), puzzle.get_width()
+        size = height * width
+        assert height <= OPTIMAL_MAX_SIDE and width <= OPTIMAL_MAX_SIDE, \
+               "puzzle too large for optimal solving"
+        self._width = width
+        self._cells = [puzzle.get_number(index // width, index % width)
+                       for index in range(size)]
+        # _distance[tile * size + index] is the Manhattan distance of
+        # tile at index to its solved position
+        self._distance = [0] * (size * size)
+        for tile in range(1, size):
+            for index in range(size):
+                self._distance[tile * size + index] = \
+                    abs(tile // width - index // width) + abs(tile % width - index % width)
+        # lines are the rows followed by the columns
+        self._line_cells = [range(row * width, (row + 1) * width) for row in range(height)] + \
+                           [range(col, size, width) for col in range(width)]
+        self._line_digits = []
+        for line in range(height + width):
+            digits = [0] * size
+            for pos in range(len(self._line_cells[line])):
+                tile = self._line_cells[line][pos]
+                if tile != 0:
+                    digits[tile] = pos + 1
+            self._line_digits.append(digits)
+        self._line_tables = [_conflict_table(width)] * height + \
+                            [_conflict_table(height)] * width
+        self._line_base = [width + 1] * height + [height + 1] * width
+        # blank index -> (direction, neighbor index, solved line of
+        # each tile that direction can change, see _search)
+        self._moves = []
+        neighbors = _neighbor_tables(height, width)
+        for zero in range(size):
+            moves = []
+            for direction in "udlr":
+                target = neighbors[direction][zero]
+                if target < 0:
+                    continue
+                lines = [-1] * size
+                for tile in range(1, size):
+                    if direction in "ud" and tile // width in (zero // width, target // width):
+                        lines[tile] = tile // width
+                    elif direction in "lr" and tile % width in (zero % width, target % width):
+                        lines[tile] = height + tile % width
+                moves.append((direction, target, lines))
+            self._moves.append(moves)
+        self._size = size
+        self._nodes = 0
+        self._path = [None] * 128
+
+    def get_nodes(self):
+        """
+        Return number of positions expanded by the last solve
+        """
+        return self._nodes
+
+    def _line_conflict(self, line):
+        """
+        Return linear conflict cost of line in the current position
+        """
+        code = 0
+        digits, base = self._line_digits[line], self._line_base[line]
+        cells = self._cells
+        for index in self._line_cells[line]:
+            code = code * base + digits[cells[index]]
+        return self._line_tables[line][code]
+
+    def is_solvable(self):
+        """
+        Check permutation parity against the distance of the blank
+        from its solved position
+        """
+        cells = self._cells
+        parity = 0
+        visited = [False] * self._size
+        for start in range(self._size):
+            length = 0
+            index = start
+            while not visited[index]:
+                visited[index] = True
+                index = cells[index]
+                length += 1
+            if length > 0:
+                parity ^= (length - 1) & 1
+        zero = cells.index(0)
+        return parity == (zero // self._width + zero % self._width) & 1
+
+    def solve(self):
+        """
+        Search for a shortest solution
+        Returns a move string
+        """
+        assert self.is_solvable(), "puzzle cannot be solved"
+        cells, size = self._cells, self._size
+        self._conflicts = [self._line_conflict(line) for line in range(len(self._line_cells))]
+        self._estimate = sum(self._distance[cells[index] * size + index]
+                             for index in range(size)) + sum(self._conflicts)
+        self._nodes = 0
+        bound = self._estimate
+        while True:
+            result = self._search(cells.index(0), 0, bound, None)
+            if result < 0:
+                return "".join(self._path[:-result - 1])
+            bound = result
+
+    def _search(self, zero, depth, bound, last):
+        """
+        Depth first search below bound on the estimated total length
+        Returns -(solution length + 1) when solved, else the smallest
+        estimate above bound
+        """
+        self._nodes += 1
+        estimate = depth + self._estimate
+        if estimate > bound:
+            return estimate
+        if self._estimate == 0:
+            return -depth - 1
+        cells, distance, size = self._cells, self._distance, self._size
+        conflicts = self._conflicts
+        inverse = INVERSE_MOVES[last]
+        smallest = 1 << 30
+        for direction, target, lines in self._moves[zero]:
+            if direction == inverse:
+                continue
+            tile = cells[target]
+            line = lines[tile]
+            old_estimate = self._estimate
+            cells[zero], cells[target] = tile, 0
+            self._estimate += distance[tile * size + zero] - distance[tile * size + target]
+            if line >= 0:
+                old_conflict = conflicts[line]
+                conflicts[line] = self._line_conflict(line)
+                self._estimate += conflicts[line] - old_conflict
+            self._path[depth] = direction
+            result = self._search(target, depth + 1, bound, direction)
+            cells[zero], cells[target] = 0, tile
+            self._estimate = old_estimate
+            if line >= 0:
+                conflicts[line] = old_conflict
+            if result < 0:
+                return result
+            smallest = min(smallest, result)
+        return smallest
+
 class Puzzle:
     """
     Class representation for the Fifteen puzzle
@@ -18,14 +239,23 @@ class Puzzle:
         """
         self._height = puzzle_height
         self._width = puzzle_width
-        self._grid = [[col + puzzle_width * row
-                       for col in range(self._width)]
-                      for row in range(self._height)]
-
+        size = puzzle_height * puzzle_width
+        typecode = "H" if size <= 1 << 16 else "L"
+        # tiles in row major order, flat index row * width + col
+        self._cells = array(typecode, range(size))
         if initial_grid != None:
-            for row in range(puzzle_height):
-                for col in range(puzzle_width):
-                    self._grid[row][col] = initial_grid[row][col]
+            self._cells = array(typecode, [initial_grid[row][col]
+                                           for row in range(puzzle_height)
+                                           for col in range(puzzle_width)])
+        # value -> flat index of the tile, kept up to date by
+        # set_number and update_puzzle
+        self._where = self._cells[:]
+        if initial_grid != None:
+            for index in range(size):
+                self._where[self._cells[index]] = index
+        self._neighbors = _neighbor_tables(puzzle_height, puzzle_width)
+        self._build_records()
+        self._solve_stats = None
 
     def __str__(self):
         """
@@ -34,7 +264,7 @@ class Puzzle:
         """
         ans = ""
         for row in range(self._height):
-            ans += str(self._grid[row])
+            ans += str(list(self._cells[row * self._width:(row + 1) * self._width]))
             ans += "\n"
         return ans
 
@@ -60,22 +290,113 @@ class Puzzle:
         Getter for the number at tile position pos
         Returns an integer
         """
-        return self._grid[row][col]
+        return self._cells[row * self._width + col]
 
     def set_number(self, row, col, value):
         """
         Setter for the number at tile position pos
         """
-        self._grid[row][col] = value
+        index = row * self._width + col
+        if index != 0:
+            if self._cells[index] == index and value != index:
+                self._cell_wrong(index)
+            elif self._cells[index] != index and value == index:
+                self._cell_right(index)
+        self._cells[index] = value
+        self._where[value] = index
 
     def clone(self):
         """
         Make a copy of the puzzle to update during solving
         Returns a Puzzle object
         """
-        new_puzzle = Puzzle(self._height, self._width, self._grid)
+        new_puzzle = copy.copy(self)
+        new_puzzle._cells = self._cells[:]
+        new_puzzle._where = self._where[:]
+        new_puzzle._row_wrong = list(self._row_wrong)
+        new_puzzle._row_last = list(self._row_last)
         return new_puzzle
 
+    def get_misplaced(self):
+        """
+        Getter for the number of tiles, other than zero, that are
+        not in their solved position
+        Returns an integer
+        """
+        return self._misplaced
+
+    ########################################################
+    # Solved records: a cell other than (0, 0) is wrong when it
+    # does not hold its solved tile, wrong cells are counted per row
+    # and _row_last[row] and _last_row bound the last wrong column of
+    # a row and the last row with wrong cells from above
+
+    def _build_records(self):
+        """
+        Build the solved records with a full scan of the grid
+        """
+        self._misplaced = 0
+        self._row_wrong = [0] * self._height
+        self._row_last = [-1] * self._height
+        self._last_row = -1
+        for index in range(1, len(self._cells)):
+            if self._cells[index] != index:
+                self._cell_wrong(index)
+
+    def _cell_wrong(self, index):
+        """
+        Record that the cell at flat index lost its solved tile
+        """
+        row, col = divmod(index, self._width)
+        self._misplaced += 1
+        self._row_wrong[row] += 1
+        if col > self._row_last[row]:
+            self._row_last[row] = col
+        if row > self._last_row:
+            self._last_row = row
+
+    def _cell_right(self, index):
+        """
+        Record that the cell at flat index got its solved tile
+        """
+        self._misplaced -= 1
+        self._row_wrong[index // self._width] -= 1
+
+    def _last_wrong_col(self, row):
+        """
+        Return the last wrong column of row, -1 when there is none
+        """
+        if self._row_wrong[row] == 0:
+            return -1
+        base = row * self._width
+        col = self._row_last[row]
+        while base + col == 0 or self._cells[base + col] == base + col:
+            col -= 1
+        self._row_last[row] = col
+        return col
+
+    def _last_wrong(self):
+        """
+        Return flat index of the last wrong cell, -1 when there is none
+        """
+        row = self._last_row
+        while row >= 0 and self._row_wrong[row] == 0:
+            row -= 1
+        self._last_row = row
+        if row < 0:
+            return -1
+        return row * self._width + self._last_wrong_col(row)
+
+    def _scan_solved_from(self, start, stop):
+        """
+        Check with a full scan that flat indices start to stop - 1
+        hold their solved tiles, used by DEBUG_SCANS
+        """
+        for index in range(start, stop):
+            if self._cells[index] != index:
+                return False
+        return True
+
     ########################################################
     # Core puzzle methods
 
@@ -86,41 +407,30 @@ class Puzzle:
         Returns a tuple of two integers        
         """
         solved_value = (solved_col + self._width * solved_row)
-
-        for row in range(self._height):
-            for col in range(self._width):
-                if self._grid[row][col] == solved_value:
-                    return (row, col)
-        assert False, "Value " + str(solved_value) + " not found"
+        return divmod(self._where[solved_value], self._width)
 
     def update_puzzle(self, move_string):
         """
         Updates the puzzle state based on the provided move string
         """
-        zero_row, zero_col = self.current_position(0, 0)
+        for direction in set(move_string):
+            assert direction in self._neighbors, "invalid direction: " + direction
+        cells, where, neighbors = self._cells, self._where, self._neighbors
+        zero = where[0]
         for direction in move_string:
-            if direction == "l":
-                assert zero_col > 0, "move off grid: " + direction
-                self._grid[zero_row][zero_col] = self._grid[zero_row][zero_col - 1]
-                self._grid[zero_row][zero_col - 1] = 0
-                zero_col -= 1
-            elif direction == "r":
-                assert zero_col < self._width - 1, "move off grid: " + direction
-                self._grid[zero_row][zero_col] = self._grid[zero_row][zero_col + 1]
-                self._grid[zero_row][zero_col + 1] = 0
-                zero_col += 1
-            elif direction == "u":
-                assert zero_row > 0, "move off grid: " + direction
-                self._grid[zero_row][zero_col] = self._grid[zero_row - 1][zero_col]
-                self._grid[zero_row - 1][zero_col] = 0
-                zero_row -= 1
-            elif direction == "d":
-                assert zero_row < self._height - 1, "move off grid: " + direction
-                self._grid[zero_row][zero_col] = self._grid[zero_row + 1][zero_col]
-                self._grid[zero_row + 1][zero_col] = 0
-                zero_row += 1
-            else:
-                assert False, "invalid direction: " + direction
+            target = neighbors[direction][zero]
+            if target < 0:
+                cells[zero], where[0] = 0, zero
+                assert False, "move off grid: " + direction
+            tile = cells[target]
+            if tile == target:
+                self._cell_wrong(target)
+            elif tile == zero:
+                self._cell_right(zero)
+            cells[zero] = tile
+            where[tile] = zero
+            zero = target
+        cells[zero], where[0] = 0, zero
 
     ##################################################################
     # Phase one methods
@@ -180,14 +490,12 @@ class Puzzle:
         Helper invariant method, checks conditions in lower_row_invariant
         except zero position
         """
-        for col in range(target_col + 1, self._width):
-            if self._grid[target_row][col] != col + self._width * target_row:
-                return False
-        for row in range(target_row + 1, self._height):
-            for col in range(0, self._width):
-                if self._grid[row][col] != col + self._width * row:
-                    return False
-        return True
+        index = target_row * self._width + target_col
+        solved = self._last_wrong() <= index
+        if DEBUG_SCANS:
+            assert solved == self._scan_solved_from(index + 1, len(self._cells)), \
+                   "solved records out of date"
+        return solved
                 
     def lower_row_invariant(self, target_row, target_col):
         """
@@ -195,9 +503,9 @@ class Puzzle:
         at the given position in the bottom rows of the puzzle (target_row > 1)
         Returns a boolean
         """
-        #print self._grid[target_row][target_col] == 0
+        #print self._cells[target_row * self._width + target_col] == 0
         #print self._lower_row_invariant_nozero(target_row, target_col)
-        return self._grid[target_row][target_col] == 0 and \
+        return self._cells[target_row * self._width + target_col] == 0 and \
                self._lower_row_invariant_nozero(target_row, target_col)
 
     def solve_interior_tile(self, target_row, target_col):
@@ -236,11 +544,14 @@ class Puzzle:
         Helper invariant method, checks columns to the right
         for upper (row < 2) invariants
         """
-        for row in range(0, 2):
-            for col in range(target_col + 1, self._width):
-                if self._grid[row][col] != col + self._width * row:
-                    return False
-        return True
+        solved = self._last_wrong_col(0) <= target_col and \
+                 self._last_wrong_col(1) <= target_col
+        if DEBUG_SCANS:
+            width = self._width
+            assert solved == (self._scan_solved_from(target_col + 1, width) and
+                              self._scan_solved_from(width + target_col + 1, 2 * width)), \
+                   "solved records out of date"
+        return solved
         
     def row0_invariant(self, target_col):
         """
@@ -248,8 +559,8 @@ class Puzzle:
         at the given column (col > 1)
         Returns a boolean
         """
-        return self._grid[0][target_col] == 0 and \
-               self._grid[1][target_col] == target_col + self._width and \
+        return self._cells[target_col] == 0 and \
+               self._cells[self._width + target_col] == target_col + self._width and \
                self._upper_row_invariant_nozero(target_col) and \
                self._lower_row_invariant_nozero(1, self._width - 1)
 
@@ -259,7 +570,7 @@ class Puzzle:
         at the given column (col > 1)
         Returns a boolean
         """
-        return self._grid[1][target_col] == 0 and \
+        return self._cells[self._width + target_col] == 0 and \
                self._upper_row_invariant_nozero(target_col) and \
                self._lower_row_invariant_nozero(1, self._width - 1)
 
@@ -301,9 +612,9 @@ class Puzzle:
         Updates the puzzle and returns a move string
         """
         solution = ""
-        if self._grid[1][0] == 1 + self._width: # left
+        if self._cells[self._width] == 1 + self._width: # left
             solution = 'lu'
-        elif self._grid[0][1] == 1 + self._width: # up
+        elif self._cells[1] == 1 + self._width: # up
             solution = 'ul'
         else:
             solution = 'lurdlu'
@@ -315,17 +626,39 @@ class Puzzle:
         Checks if a part of the puzzle is already solved
         Returns first unsolved position in (row, col) format
         """
-        for row in range(self._height - 1, -1, -1):
-            for col in range(self._width - 1, -1, -1):
-                if self._grid[row][col] != col + row * self._width:
-                    return row, col
-        return 0, 0
+        last = self._last_wrong()
+        if DEBUG_SCANS:
+            assert self._scan_solved_from(last + 1, len(self._cells)) and \
+                   (last < 1 or self._cells[last] != last), "solved records out of date"
+        if last < 0:
+            return 0, 0
+        return divmod(last, self._width)
         
-    def solve_puzzle(self):
+    def get_solve_stats(self):
+        """
+        Getter for statistics of the last optimal solve
+        Returns a dictionary with nodes expanded and seconds taken,
+        None before the first optimal solve
+        """
+        return self._solve_stats
+
+    def solve_puzzle(self, mode = "phases"):
         """
         Generate a solution string for a puzzle
+        mode "phases" solves row by row, mode "optimal" finds a
+        shortest solution with OptimalSolver for boards of at most
+        4 rows and 4 columns
         Updates the puzzle and returns a move string
         """
+        assert mode in ("phases", "optimal"), "invalid mode: " + str(mode)
+        if mode == "optimal":
+            start = time.time()
+            solver = OptimalSolver(self)
+            solution = solver.solve()
+            self._solve_stats = {"nodes": solver.get_nodes(),
+                                 "seconds": time.time() - start}
+            self.update_puzzle(solution)
+            return solution
         #zero_pos = self.current_position(0, 0)
         move_zero, solution = "", ""
         starting_row, starting_col = self._is_solved()
@@ -411,5 +744,11 @@ def test_puzzle():
     print p4x5
     print p4x5.solve_puzzle()
     print p4x5
+    print " --- Testing optimal 4x4 --- "
+    p4x4 = Puzzle(4, 4)
+    p4x4.update_puzzle('rdrdrdllluuurrrdddlululu')
+    print p4x4.solve_puzzle("optimal")
+    print p4x4.get_solve_stats()
+    print p4x4
 
 #test_puzzle()